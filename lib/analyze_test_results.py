@@ -1,24 +1,141 @@
+import argparse
 import sys
 import json
 import os
 import time
-import imgkit
+from collections import defaultdict
 
+import summary_image
 
-def load_tests(test_folder):
+
+class TestList(list):
+    """
+    A list of tests, indexed by test type
+    """
+
+    def __init__(self, tests=()):
+        super().__init__()
+        self.by_type = defaultdict(list)
+        for test in tests:
+            self.append(test)
+
+    def append(self, test):
+        super().append(test)
+        self.by_type[test["test_type"]].append(test)
+
+    def of_type(self, test_type):
+        return self.by_type[test_type]
+
+
+class Results:
+    """
+    The results of the tests of an app, recorded one by one as the tests are
+    done, such that we can tell at any point which levels can still be reached
+    """
+
+    # What a pending test could at best report
+    BEST_CASE_RESULTS = {
+        "main_result": "success",
+        "critical": [],
+        "error": [],
+        "warning": [],
+        "success": ["App.qualify_for_level_7", "App.qualify_for_level_8"],
+    }
+
+    def __init__(self, tests):
+        self.done = TestList()
+        self.pending = {test["id"]: test for test in tests}
+
+    def record(self, test_id, results):
+        test = self.pending.pop(test_id)
+        test["results"] = results
+        test["notes"] = list(test_notes(test))
+        self.done.append(test)
+
+    def best_case(self):
+        # Tests depending on an install are doomed to fail once all the actual
+        # installs are done and failed (cf at_least_one_install_succeeded)
+        installs = [
+            t
+            for t in self.done.of_type("TEST_INSTALL")
+            + [t for t in self.pending.values() if t["test_type"] == "TEST_INSTALL"]
+            if not t.get("depends_on")
+        ]
+        all_installs_failed = all(
+            t.get("results", {}).get("main_result") == "failure" for t in installs
+        )
+
+        return TestList(
+            list(self.done)
+            + [
+                dict(
+                    test,
+                    results=(
+                        {"main_result": "failure"}
+                        if test.get("depends_on") and all_installs_failed
+                        else self.BEST_CASE_RESULTS
+                    ),
+                )
+                for test in self.pending.values()
+            ]
+        )
+
+    def reachable_levels(self):
+        tests = self.best_case()
+        return [level for level in levels[1:] if level(tests)]
+
+    def max_reachable_level(self):
+        tests = self.best_case()
+        max_level = level_0
+        for level in levels[1:]:
+            if not level(tests):
+                break
+            max_level = level
+        return max_level
+
+
+def load_results(test_folder):
+    tests = []
     for test in sorted(os.listdir(test_folder + "/tests")):
         j = json.load(open(test_folder + "/tests/" + test))
         j["id"] = os.path.basename(test).split(".")[0]
-        j["results"] = json.load(open(test_folder + "/results/" + j["id"] + ".json"))
-        j["notes"] = list(test_notes(j))
+        tests.append(j)
 
-        yield j
+    results = Results(tests)
+    for test in tests:
+        results_file = test_folder + "/results/" + test["id"] + ".json"
+        if not os.path.exists(results_file):
+            continue
+        test_results = json.load(open(results_file))
+        # (Tests being ran have an empty result file)
+        if "main_result" in test_results:
+            results.record(test["id"], test_results)
+
+    return results
+
+
+def follow(test_folder, results):
+    """
+    Keep the results in memory for the whole run, and only record the test
+    that just got done each time (cf min_level_is_unreachable)
+    """
+    for line in sys.stdin:
+        test_id = line.strip()
+        results_file = test_folder + "/results/" + test_id + ".json"
+        if test_id in results.pending and os.path.exists(results_file):
+            test_results = json.load(open(results_file))
+            if "main_result" in test_results:
+                results.record(test_id, test_results)
+        print(results.max_reachable_level().level, flush=True)
 
 
 # We'll laterdisplay the result of these sort of "meta" or "tranversal" checks performed during each checks
 # regarding nginx path traversal issue or install dir permissions... we want to display those in the summary
 # Also we want to display the number of warnings for linter results
 def test_notes(test):
+    if test["results"].get("cached"):
+        yield "cached"
+
     # (We ignore these for upgrades from older commits)
     if test["test_type"] == "TEST_UPGRADE" and test["test_arg"]:
         return
@@ -81,8 +198,8 @@ def level_1(tests):
     And there are no critical issues in the linter
     """
 
-    linter_tests = [t for t in tests if t["test_type"] == "TEST_PACKAGE_LINTER"]
-    install_tests = [t for t in tests if t["test_type"] == "TEST_INSTALL"]
+    linter_tests = tests.of_type("TEST_PACKAGE_LINTER")
+    install_tests = tests.of_type("TEST_INSTALL")
     witness_missing_detected = any(t["results"].get("witness") for t in tests)
 
     return (
@@ -99,7 +216,7 @@ def level_2(tests):
     All install tests succeeded (and at least one test was made)
     """
 
-    install_tests = [t for t in tests if t["test_type"] == "TEST_INSTALL"]
+    install_tests = tests.of_type("TEST_INSTALL")
 
     return install_tests != [] and all(
         t["results"]["main_result"] == "success" for t in install_tests
@@ -113,7 +230,7 @@ def level_3(tests):
     """
 
     upgrade_same_version_tests = [
-        t for t in tests if t["test_type"] == "TEST_UPGRADE" and not t["test_arg"]
+        t for t in tests.of_type("TEST_UPGRADE") if not t["test_arg"]
     ]
 
     return upgrade_same_version_tests != [] and all(
@@ -127,7 +244,7 @@ def level_4(tests):
     All backup/restore tests succeded (and at least one test was made)
     """
 
-    backup_tests = [t for t in tests if t["test_type"] == "TEST_BACKUP_RESTORE"]
+    backup_tests = tests.of_type("TEST_BACKUP_RESTORE")
 
     return backup_tests != [] and all(
         t["results"]["main_result"] == "success" for t in backup_tests
@@ -143,7 +260,7 @@ def level_5(tests):
     """
 
     alias_traversal_detected = any(t["results"].get("alias_traversal") for t in tests)
-    linter_tests = [t for t in tests if t["test_type"] == "TEST_PACKAGE_LINTER"]
+    linter_tests = tests.of_type("TEST_PACKAGE_LINTER")
 
     return (
         not alias_traversal_detected
@@ -159,7 +276,7 @@ def level_6(tests):
     (the linter will report a warning named "is_in_github_org" if it's not)
     """
 
-    linter_tests = [t for t in tests if t["test_type"] == "TEST_PACKAGE_LINTER"]
+    linter_tests = tests.of_type("TEST_PACKAGE_LINTER")
 
     return (
         linter_tests != []
@@ -174,7 +291,7 @@ def level_7(tests):
     linter which will report a "qualify_for_level_7" in successes)
     """
 
-    linter_tests = [t for t in tests if t["test_type"] == "TEST_PACKAGE_LINTER"]
+    linter_tests = tests.of_type("TEST_PACKAGE_LINTER")
 
     # For runtime warnings, ignore stuff happening during upgrades from previous versions
     tests_on_which_to_check_for_runtime_warnings = [
@@ -220,7 +337,7 @@ def level_8(tests):
     which will report a "qualify_for_level_8")
     """
 
-    linter_tests = [t for t in tests if t["test_type"] == "TEST_PACKAGE_LINTER"]
+    linter_tests = tests.of_type("TEST_PACKAGE_LINTER")
 
     return (
         linter_tests != []
@@ -228,7 +345,10 @@ def level_8(tests):
     )
 
 
-def make_summary():
+global_level = None
+
+
+def make_summary(tests):
     test_types = {
         "TEST_PACKAGE_LINTER": "Package linter",
         "TEST_INSTALL": "Install",
@@ -250,11 +370,12 @@ def make_summary():
             latest_test_serie = test["test_serie"]
             yield "------------- %s -------------" % latest_test_serie
 
-        result = (
-            " <style=success>OK</style>"
-            if test["results"]["main_result"] == "success"
-            else "<style=danger>fail</style>"
-        )
+        if test["results"]["main_result"] == "success":
+            result = " <style=success>OK</style>"
+        elif test["results"]["main_result"] == "skipped":
+            result = "<style=warning>skipped</style>"
+        else:
+            result = "<style=danger>fail</style>"
 
         if test["notes"]:
             result += "  (%s)" % ", ".join(test["notes"])
@@ -304,68 +425,60 @@ def render_for_terminal(text):
     )
 
 
-def export_as_image(text, output):
-    text = (
-        text.replace(
-            "<style=success>", '<span style="color: chartreuse; font-weight: bold;">'
-        )
-        .replace("<style=warning>", '<span style="color: gold;">')
-        .replace("<style=danger>", '<span style="color: red;">')
-        .replace("<style=bold>", '<span style="font-weight: bold;">')
-        .replace("</style>", "</span>")
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("test_context", help="Path to the test context folder")
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Read the ids of the tests as they get done on stdin, and print the highest level that can still be reached after each one",
     )
+    args = parser.parse_args()
 
-    text = f"""
-<html style="color: #eee; background-color: #222; font-family: monospace">
-<body>
-<pre>
-{text}
-</pre>
-</body>
-</html>"""
-
-    imgkit.from_string(text, output, options={"crop-w": 600, "quiet": ""})
-
+    test_context = args.test_context
+    results = load_results(test_context)
 
-test_context = sys.argv[1]
-tests = list(load_tests(test_context))
+    if args.follow:
+        follow(test_context, results)
+        return
 
-global_level = None
+    tests = TestList(sorted(results.done, key=lambda t: t["id"]))
+
+    summary = "\n".join(make_summary(tests))
+    print(render_for_terminal(summary))
+
+    summary_image.export(summary, f"{test_context}/summary.png")
+    summary_image.export(summary, f"{test_context}/summary.svg")
+
+    summary = {
+        "app": open(test_context + "/app_id").read().strip(),
+        "app_version": open(test_context + "/app_version").read().strip(),
+        "commit": open(test_context + "/commit").read().strip(),
+        "commit_timestamp": int(
+            open(test_context + "/commit_timestamp").read().strip()
+        ),
+        "architecture": open(test_context + "/architecture").read().strip(),
+        "yunohost_version": open(test_context + "/ynh_version").read().strip(),
+        "yunohost_branch": open(test_context + "/ynh_branch").read().strip(),
+        "timestamp": int(time.time()),
+        "tests": [
+            {
+                "test_type": t["test_type"],
+                "test_arg": t["test_arg"],
+                "test_serie": t["test_serie"],
+                "main_result": t["results"]["main_result"],
+                "test_duration": t["results"]["test_duration"],
+                "test_notes": t["notes"],
+                "cached": t["results"].get("cached", False),
+            }
+            for t in tests
+        ],
+        "level_results": {level.level: level.passed for level in levels[1:]},
+        "level": global_level.level,
+    }
 
-summary = "\n".join(make_summary())
-print(render_for_terminal(summary))
+    sys.stderr.write(json.dumps(summary, indent=4))
 
-if os.path.exists("/usr/bin/wkhtmltoimage"):
-    export_as_image(summary, f"{test_context}/summary.png")
-    if os.path.exists("/usr/bin/optipng"):
-        os.system(f"/usr/bin/optipng --quiet '{test_context}/summary.png'")
-else:
-    print(
-        "(Protip™ for CI admin: you should 'apt install wkhtmltopdf optipng --no-install-recommends' to enable result summary export to .png)"
-    )
 
-summary = {
-    "app": open(test_context + "/app_id").read().strip(),
-    "app_version": open(test_context + "/app_version").read().strip(),
-    "commit": open(test_context + "/commit").read().strip(),
-    "commit_timestamp": int(open(test_context + "/commit_timestamp").read().strip()),
-    "architecture": open(test_context + "/architecture").read().strip(),
-    "yunohost_version": open(test_context + "/ynh_version").read().strip(),
-    "yunohost_branch": open(test_context + "/ynh_branch").read().strip(),
-    "timestamp": int(time.time()),
-    "tests": [
-        {
-            "test_type": t["test_type"],
-            "test_arg": t["test_arg"],
-            "test_serie": t["test_serie"],
-            "main_result": t["results"]["main_result"],
-            "test_duration": t["results"]["test_duration"],
-            "test_notes": t["notes"],
-        }
-        for t in tests
-    ],
-    "level_results": {level.level: level.passed for level in levels[1:]},
-    "level": global_level.level,
-}
-
-sys.stderr.write(json.dumps(summary, indent=4))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# Syncs the package into /app_folder in the container, before each yunohost
+# command. The container keeps a manifest of the content hash of every file of
+# its copy, so only what changed is sent, as a single tar streamed through a
+# single exec. That manifest being in the container, it rolls back together with
+# the files when a snapshot is restored.
+#
+# When nothing changed locally since the last sync (and no snapshot was restored
+# since, cf LOAD_LXC_SNAPSHOT which removes the 'synced' file of the state dir),
+# nothing is ran in the container at all.
+#
+#   app_folder_sync.py <package_path> <container> --lxc incus --state <dir>
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import stat
+import subprocess
+import sys
+import tarfile
+
+APP_FOLDER = "app_folder"
+MANIFEST = "var/cache/package_check/app_folder.json"
+# Beyond that, it's simpler to send everything again
+MAX_REMOVALS = 1000
+
+# Removes what changed type or disappeared (the paths are given as arguments),
+# then extracts the tar sent on stdin
+APPLY = f"""
+set -e
+if [ "$1" = full ]; then rm -rf /{APP_FOLDER}; fi
+shift
+mkdir -p /{APP_FOLDER} /{os.path.dirname(MANIFEST)}
+cd /{APP_FOLDER}
+rm -rf -- "$@"
+tar -x -C / --no-same-owner
+"""
+
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def scan(package_path, hashes):
+    """
+    {relative path: [type, mode, hash or link target]} for everything in the
+    package. Files are only hashed again when their size or mtime changed
+    """
+    manifest = {}
+    new_hashes = {}
+    for root, dirs, files in os.walk(package_path):
+        dirs.sort()
+        for name in sorted(dirs) + sorted(files):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, package_path)
+            st = os.lstat(path)
+            mode = stat.S_IMODE(st.st_mode)
+            if stat.S_ISLNK(st.st_mode):
+                manifest[rel] = ["l", mode, os.readlink(path)]
+            elif stat.S_ISDIR(st.st_mode):
+                manifest[rel] = ["d", mode, None]
+            elif stat.S_ISREG(st.st_mode):
+                key = [st.st_size, st.st_mtime_ns]
+                cached = hashes.get(rel)
+                sha = cached[2] if cached and cached[:2] == key else file_hash(path)
+                new_hashes[rel] = key + [sha]
+                manifest[rel] = ["f", mode, sha]
+    return manifest, new_hashes
+
+
+def remote_manifest(lxc, container):
+    cat = subprocess.run(
+        [lxc, "exec", container, "--", "cat", f"/{MANIFEST}"],
+        capture_output=True,
+        text=True,
+    )
+    if cat.returncode != 0:
+        return None
+    try:
+        return json.loads(cat.stdout)
+    except ValueError:
+        return None
+
+
+def diff(local, remote):
+    if remote is None:
+        return True, sorted(local), []
+
+    changed = [path for path in sorted(local) if remote.get(path) != local[path]]
+    # A directory replaced by a file (or the other way around) has to go first
+    removed = [
+        path
+        for path, entry in remote.items()
+        if path not in local or local[path][0] != entry[0]
+    ]
+    # (No need to remove what's in a directory which is removed anyway)
+    removed_set = set(removed)
+    removed = sorted(
+        path
+        for path in removed
+        if not any(parent in removed_set for parent in parents(path))
+    )
+    if len(removed) > MAX_REMOVALS:
+        return True, sorted(local), []
+    return False, changed, removed
+
+
+def parents(path):
+    while os.path.dirname(path):
+        path = os.path.dirname(path)
+        yield path
+
+
+def send(lxc, container, package_path, local, full, changed, removed):
+    exec_ = subprocess.Popen(
+        [lxc, "exec", container, "--", "/bin/bash", "-c", APPLY, "apply"]
+        + ["full" if full else "incremental"]
+        + removed,
+        stdin=subprocess.PIPE,
+    )
+    sent = 0
+    with tarfile.open(fileobj=exec_.stdin, mode="w|") as tar:
+        for path in changed:
+            info = tar.gettarinfo(
+                os.path.join(package_path, path), arcname=f"{APP_FOLDER}/{path}"
+            )
+            info.uid = info.gid = 0
+            info.uname = info.gname = "root"
+            if info.isfile():
+                with open(os.path.join(package_path, path), "rb") as f:
+                    tar.addfile(info, f)
+                sent += info.size
+            else:
+                tar.addfile(info)
+
+        # The manifest goes last: if anything fails before, the next sync will send it all again
+        data = json.dumps(local).encode()
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(data)
+        info.mode = 0o600
+        tar.addfile(info, io.BytesIO(data))
+    exec_.stdin.close()
+    return exec_.wait(), sent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("package_path")
+    parser.add_argument("container")
+    parser.add_argument("--lxc", default="lxc", help="lxc or incus")
+    parser.add_argument(
+        "--state",
+        required=True,
+        help="Directory where to keep the hashes of the files and the last sync",
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.state, exist_ok=True)
+    hashes_file = os.path.join(args.state, "hashes.json")
+    synced_file = os.path.join(args.state, "synced")
+
+    local, hashes = scan(args.package_path, load_json(hashes_file, {}))
+    write_json(hashes_file, hashes)
+    digest = hashlib.sha256(json.dumps(local, sort_keys=True).encode()).hexdigest()
+
+    if os.path.exists(synced_file) and open(synced_file).read() == digest:
+        print("/app_folder is already up to date")
+        return
+
+    # Whatever happens next, it may not be in sync anymore
+    if os.path.exists(synced_file):
+        os.remove(synced_file)
+
+    full, changed, removed = diff(local, remote_manifest(args.lxc, args.container))
+    returncode, sent = send(
+        args.lxc, args.container, args.package_path, local, full, changed, removed
+    )
+    if returncode != 0:
+        print(f"Failed to sync /app_folder (exit code {returncode})", file=sys.stderr)
+        sys.exit(1)
+
+    with open(synced_file, "w") as f:
+        f.write(digest)
+    print(
+        f"{'Sent' if full else 'Synced'} /app_folder: {len(changed)} files or"
+        f" directories ({sent // 1024}KB), {len(removed)} removed"
+    )
+
+
+if __name__ == "__main__":
+    main()
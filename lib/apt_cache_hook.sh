@@ -0,0 +1,51 @@
+#!/bin/bash
+
+# Installed in the containers as /usr/local/bin/package_check_apt_cache, and
+# called by apt (cf _APT_CACHE_SETUP in lib/lxc.sh).
+#
+# The packages downloaded by apt are shared by all the containers of the host,
+# in a directory of the host mounted on /var/cache/apt/shared. Each container
+# keeps its own /var/cache/apt/archives (and thus its own apt lock and partial
+# downloads), in which the packages of the shared cache are symlinked: apt then
+# considers them as already downloaded.
+#
+#   package_check_apt_cache seed     (after 'apt update' and each dpkg run)
+#   package_check_apt_cache record   (with the .deb about to be installed on stdin)
+
+shared=/var/cache/apt/shared
+archives=/var/cache/apt/archives
+
+# (e.g. in a container created from a cached snapshot, with the cache disabled since)
+mountpoint -q "$shared" || exit 0
+
+case "$1" in
+    seed)
+        for deb in "$shared"/*.deb; do
+            [ -e "$deb" ] || continue
+            [ -e "$archives/${deb##*/}" ] || ln -sf "$deb" "$archives/"
+        done
+        ;;
+    record)
+        # Called before dpkg, cf DPkg::Pre-Install-Pkgs: the packages which are still symlinks
+        # came from the shared cache, the other ones were downloaded and get added to it
+        mkdir -p "$shared/.stats"
+        while read -r deb; do
+            [[ "$deb" == *.deb ]] && [ -e "$deb" ] || continue
+            name=${deb##*/}
+            if [ -L "$deb" ]; then
+                status=hit
+                # (The least recently used packages are evicted first, cf _APT_CACHE_EVICT)
+                touch "$deb"
+            else
+                status=miss
+                if [ ! -e "$shared/$name" ]; then
+                    # (Other containers may be adding the same one at the same time)
+                    cp "$deb" "$shared/.$name.$$" && mv "$shared/.$name.$$" "$shared/$name"
+                fi
+            fi
+            echo "$(date +%s) $status $(stat -L -c %s "$deb") $name" >> "$shared/.stats/$(hostname)"
+        done
+        ;;
+esac
+
+exit 0
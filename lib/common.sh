@@ -23,9 +23,48 @@ YNH_BRANCH=${YNH_BRANCH:-stable}
 WORKER_ID=${WORKER_ID:-0}
 LXC_BASE="yunohost-$DIST-$YNH_BRANCH-appci"
 LXC_NAME="ynh-appci-$DIST-$ARCH-$YNH_BRANCH-test-${WORKER_ID}"
+# Containers launched in advance in batch mode
+LXC_POOL_PREFIX="ynh-appci-$DIST-$ARCH-$YNH_BRANCH-pool-${WORKER_ID}"
 
 readonly lock_file="./pcheck-${WORKER_ID}.lock"
 
+# Results of successful tests, reused when a test's inputs didn't change (cf --no-cache)
+readonly results_cache_dir="./results_cache"
+RESULTS_CACHE_MAX_AGE=${RESULTS_CACHE_MAX_AGE:-30}
+
+# Results of the package linter for a given commit of the app and of the linter
+# (it also does checks against the network, hence a max age in days)
+readonly linter_cache_dir="./linter_cache"
+LINTER_CACHE_MAX_AGE=${LINTER_CACHE_MAX_AGE:-1}
+
+# Number of containers to run the tests on in parallel
+PARALLEL_JOBS=${PARALLEL_JOBS:-1}
+
+# In batch mode (cf --batch), number of containers launched in advance for the
+# next apps, and how long to wait for more apps in the queue once it's empty
+# (in seconds, e.g. to keep running as a daemon)
+BATCH_POOL_SIZE=${BATCH_POOL_SIZE:-1}
+BATCH_IDLE_TIMEOUT=${BATCH_IDLE_TIMEOUT:-0}
+
+# The initial state of the container (base image + apt dependencies of the app)
+# is published as an image and reused across runs and workers.
+# Max size of the cache is in GB, max age in days.
+SNAPSHOT_CACHE=${SNAPSHOT_CACHE:-true}
+SNAPSHOT_CACHE_MAX_SIZE=${SNAPSHOT_CACHE_MAX_SIZE:-20}
+SNAPSHOT_CACHE_MAX_AGE=${SNAPSHOT_CACHE_MAX_AGE:-7}
+readonly snapshot_cache_stats="./snapshot_cache_stats.log"
+
+# The packages downloaded by apt in the containers are shared by all the workers
+# of the host, in this directory (cf lib/apt_cache_hook.sh). Max size is in GB.
+APT_CACHE=${APT_CACHE:-true}
+APT_CACHE_DIR=${APT_CACHE_DIR:-/var/cache/package_check/apt}
+APT_CACHE_MAX_SIZE=${APT_CACHE_MAX_SIZE:-10}
+
+# The containers are ready once booted, with an IP, and able to reach this URL
+# (e.g. a local mirror, or empty not to check), within this time in seconds
+READINESS_PROBE_URL=${READINESS_PROBE_URL-http://wikipedia.org}
+READINESS_TIMEOUT=${READINESS_TIMEOUT:-60}
+
 #=================================================
 # LXC helpers
 #=================================================
@@ -235,52 +274,48 @@ stop_timer () {
 #=================================================
 # Resource metrics helpers
 #=================================================
-# Communication between the background thread and the main one
-# is done via a shared memory.
-
-get_ram_usage() {
-    RUN_INSIDE_LXC free -m | grep Mem | awk '{print $3}'
-}
+# The RAM, CPU, IO... of the container are sampled from the host by
+# lib/metrics_sampler.py, which writes the time series of each test in
+# $TEST_CONTEXT/metrics/ and prints a summary when stopped.
 
 get_disk_usage() {
     RUN_INSIDE_LXC df --output="used" --total -k -l | tail -n 1
 }
 
-metrics_background_thread() {
-    declare -A resources=( [ram]=0 )
-    while true; do
-        ram_usage=$(get_ram_usage)
-        #echo "$ram_usage"
-        if ((ram_usage > resources[ram])); then
-            resources[ram]=$ram_usage
-        fi
-        declare -p resources > "$TEST_CONTEXT/metrics_vars"
-        sleep 1
-    done
-}
-
 metrics_start() {
-    ram_usage_base=$(get_ram_usage)
     disk_usage_base=$(get_disk_usage)
-    metrics_background_thread &
-    metrics_background_thread_pid=$!
+    mkdir -p "$TEST_CONTEXT/metrics"
+    # shellcheck disable=SC2154
+    python3 lib/metrics_sampler.py "$LXC_NAME" --lxc "$lxc" \
+        --output "$TEST_CONTEXT/metrics/$current_test_id.jsonl" \
+        > "$current_test_tmp/metrics_summary.json" &
+    metrics_sampler_pid=$!
 }
 
 metrics_stop() {
-    kill "$metrics_background_thread_pid"
-    # shellcheck disable=SC1091
-    source "$TEST_CONTEXT/metrics_vars"
-    ram_usage_end=$(get_ram_usage)
+    kill "$metrics_sampler_pid"
+    wait "$metrics_sampler_pid"
     disk_usage_end=$(get_disk_usage)
 
-    max_ram_usage_diff_peak=$((resources[ram] - ram_usage_base))
-    max_ram_usage_diff_end=$((ram_usage_end - ram_usage_base))
-    max_disk_usage_diff_end=$(awk -v before="$disk_usage_base" -v after="$disk_usage_end"\
+    local summary="$current_test_tmp/metrics_summary.json"
+    if ! jq -e . "$summary" >/dev/null 2>&1; then
+        log_warning "Could not sample the resources used by the container during this test"
+        return
+    fi
+
+    local max_ram_usage_diff_peak=$(jq -r '.peak_ram_usage' "$summary")
+    local max_ram_usage_diff_end=$(jq -r '.ram_end_mb - .ram_base_mb' "$summary")
+    local max_disk_usage_diff_end=$(awk -v before="$disk_usage_base" -v after="$disk_usage_end"\
         'BEGIN{printf "%.1f\n", (after - before)/1024}')
 
+    # (Keep the highest peak when there are several measurements in the same test)
+    results_store set "$current_test_id" peak_ram_usage "$max_ram_usage_diff_peak" --json --max
+    results_store set "$current_test_id" metrics "$(jq -c --argjson disk "$max_disk_usage_diff_end" '.disk_usage_diff_mb = $disk' "$summary")" --json --append
+
     log_info "Peak RAM usage during this test: ${max_ram_usage_diff_peak}MB"
     log_info "RAM usage diff after test: ${max_ram_usage_diff_end}MB"
     log_info "Disk usage diff after test: ${max_disk_usage_diff_end}MB"
+    log_debug "$(jq -r '"CPU: \(.cpu_mean_percent)% on average, \(.cpu_peak_percent)% at most - IO: \(.io_read_mb)MB read, \(.io_write_mb)MB written - Peak RAM: \(.ram_peak_mb)MB (\(.samples) samples in \(.duration)s)"' "$summary")"
 }
 
 #=================================================
@@ -380,9 +415,6 @@ function fetch_package_to_test() {
     git -C "$package_path" rev-parse HEAD > "$TEST_CONTEXT/commit"
     git -C "$package_path" show --no-patch --format=%ct HEAD > "$TEST_CONTEXT/commit_timestamp"
 
-    python3 -c "import sys; import toml; f = open(sys.argv[1], 'r'); print(toml.load(f)['version'])" \
-        "$package_path/manifest.toml" > "$TEST_CONTEXT/app_version"
-
     # Check if the package directory is really here.
     if [ ! -d "$package_path" ]; then
         log_critical "Unable to find the directory $package_path for the package..."
@@ -1,25 +1,86 @@
 import os
 import sys
+import io
+import json
+import argparse
+import signal
+import socketserver
+import traceback
 import toml
 import time
 import re
+import random
+import codecs
 import tempfile
+import heapq
+import itertools
 import pycurl
-from bs4 import BeautifulSoup
+from collections import Counter, deque
+from lxml import etree
 from urllib.parse import urlencode, urljoin, urlparse
 from io import BytesIO
 
-DOMAIN = os.environ["DOMAIN"]
-DIST = os.environ["DIST"]
-SUBDOMAIN = os.environ["SUBDOMAIN"]
-USER = os.environ["USER"]
-PASSWORD = os.environ["PASSWORD"]
-LXC_IP = os.environ["LXC_IP"]
-BASE_URL = os.environ["BASE_URL"].rstrip("/")
-APP_DOMAIN = BASE_URL.replace("https://", "").replace("http://", "").split("/")[0]
+
+def configure(environ):
+    """
+    Read the configuration from the environment (cf main() and serve(), where
+    each validation comes with its own environment)
+    """
+    global DOMAIN, DIST, SUBDOMAIN, USER, PASSWORD, LXC_IP, BASE_URL, APP_DOMAIN
+    global CONCURRENCY, MAX_BODY_SIZE
+
+    DOMAIN = environ["DOMAIN"]
+    DIST = environ["DIST"]
+    SUBDOMAIN = environ["SUBDOMAIN"]
+    USER = environ["USER"]
+    PASSWORD = environ["PASSWORD"]
+    LXC_IP = environ["LXC_IP"]
+    BASE_URL = environ["BASE_URL"].rstrip("/")
+    APP_DOMAIN = BASE_URL.replace("https://", "").replace("http://", "").split("/")[0]
+    # Max number of transfers running at the same time in the pycurl multi-handle
+    CONCURRENCY = max(1, int(environ.get("CURL_TESTS_CONCURRENCY", 8)))
+    # We stop downloading responses bigger than this (in bytes) and work with what we got so far
+    MAX_BODY_SIZE = int(environ.get("CURL_TESTS_MAX_BODY_SIZE", 5 * 1024 * 1024))
+
+    DEFAULTS["base_url"] = BASE_URL
+
+
+# How much of the page's text we keep when no expect_content needs the whole of it
+CONTENT_PREVIEW_SIZE = 1000
+# Bounds of the (exponential, jittered) delay between two polls of an app which isn't ready yet
+READY_POLL_MIN_DELAY = 0.2
+READY_POLL_MAX_DELAY = 5
+# Load tests (cf the load option of the tests), when not specified
+LOAD_DEFAULT_CONCURRENCY = 10
+LOAD_DEFAULT_DURATION = 10
+
+# Share the DNS cache, TLS sessions and (if libcurl is recent enough) the live
+# connections between all handles, such that we reuse keep-alive connections
+# to the container instead of doing a new TCP+TLS handshake for each request
+SHARE = pycurl.CurlShare()
+SHARE.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+SHARE.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+if hasattr(pycurl, "LOCK_DATA_CONNECT"):
+    SHARE.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+
+# (SIZE_DOWNLOAD is deprecated in recent pycurl versions, but older ones don't have the _T variant)
+SIZE_DOWNLOAD = getattr(pycurl, "SIZE_DOWNLOAD_T", pycurl.SIZE_DOWNLOAD)
+
+# Cookie jars of the SSO sessions opened during this run, indexed by (domain, user)
+# (None means that some test is currently logging in)
+SSO_SESSIONS = {}
+
+# Assets checked during this run, indexed by (resolved url, is a stylesheet, cookie jar), such that
+# assets shared by several pages (or the _noslash twin tests) are fetched only once
+# (None means that some test is currently fetching it)
+ASSETS_CACHE = {}
+# Partial content is fine when checking an asset, we only ask for its first byte
+ASSET_OK_CODES = {200, 206}
+# Stuff injected by YunoHost in the app's pages, which is not the app's business
+YNH_ASSETS = ["ynh_portal", "ynhtheme", "ynh_overlay"]
 
 DEFAULTS = {
-    "base_url": BASE_URL,
+    "base_url": None,  # (cf configure())
     "path": "/",
     "logged_on_sso": False,
     "expect_title": None,
@@ -27,6 +88,9 @@ DEFAULTS = {
     "expect_return_code": 200,
     "expect_effective_url": None,
     "auto_test_assets": False,
+    "ready_timeout": 30,
+    "expect_max_ttfb": None,
+    "expect_max_total_time": None,
 }
 
 # Example of expected conf:
@@ -55,13 +119,16 @@ DEFAULTS = {
 # ==============================================
 
 
-def curl(
+def prepare_handle(
     full_url,
     method="GET",
     use_cookies=None,
     save_cookies=None,
     post=None,
     referer=None,
+    page=None,
+    probe=False,
+    discard=False,
 ):
     domain = full_url.replace("https://", "").replace("http://", "").split("/")[0]
 
@@ -78,6 +145,8 @@ def curl(
     )  # --resolve
     c.setopt(c.INTERFACE, "if!incusbr0")  # --interface
     c.setopt(c.HTTPHEADER, [f"Host: {domain}", "X-Requested-With: libcurl"])  # --header
+    c.setopt(c.SHARE, SHARE)
+    c.setopt(c.TCP_KEEPALIVE, 1)
     if use_cookies:
         c.setopt(c.COOKIEFILE, use_cookies)
     if save_cookies:
@@ -86,21 +155,431 @@ def curl(
         c.setopt(c.POSTFIELDS, urlencode(post))
     if referer:
         c.setopt(c.REFERER, referer)
-    buffer = BytesIO()
-    c.setopt(c.WRITEDATA, buffer)
-    c.perform()
+    if probe:
+        # We only want to know if it's there, not download it
+        c.setopt(c.RANGE, "0-0")
+
+    # Stream the body into the page extractor (or a plain buffer) and abort the
+    # transfer as soon as we have all we need, or the body is too big
+    c.page = page
+    c.buffer = BytesIO()
+    c.received = 0
+    c.stopped_early = False
+
+    def write(chunk):
+        c.received += len(chunk)
+        if c.page:
+            c.page.feed(chunk)
+            keep_going = not c.page.done
+        else:
+            if not discard:
+                c.buffer.write(chunk[: max(0, MAX_BODY_SIZE - c.buffer.tell())])
+            keep_going = not probe
+        if c.received > MAX_BODY_SIZE:
+            keep_going = False
+            if c.page:
+                c.page.truncated = True
+        if not keep_going:
+            c.stopped_early = True
+            return 0
+
+    c.setopt(c.WRITEFUNCTION, write)
 
+    return c
+
+
+def stopped_early(c, errno):
+    # Aborting from the write callback makes curl report a write error, though
+    # we did get the response code, headers and all the content we wanted
+    return errno == pycurl.E_WRITE_ERROR and c.stopped_early
+
+
+def collect_response(c):
     effective_url = c.getinfo(c.EFFECTIVE_URL)
     return_code = c.getinfo(c.RESPONSE_CODE)
 
-    try:
-        return_content = buffer.getvalue().decode()
-    except UnicodeDecodeError:
-        return_content = "(Binary content?)"
+    if c.page:
+        c.page.finish()
+        return_content = c.page.content
+    else:
+        try:
+            return_content = c.buffer.getvalue().decode()
+        except UnicodeDecodeError:
+            return_content = "(Binary content?)"
+
+    timings = response_timings(c)
 
     c.close()
 
-    return (return_code, return_content, effective_url)
+    return (return_code, return_content, effective_url, timings)
+
+
+def response_timings(c):
+    return {
+        "namelookup": round(c.getinfo(c.NAMELOOKUP_TIME), 4),
+        "connect": round(c.getinfo(c.CONNECT_TIME), 4),
+        "appconnect": round(c.getinfo(c.APPCONNECT_TIME), 4),
+        "ttfb": round(c.getinfo(c.STARTTRANSFER_TIME), 4),
+        "total": round(c.getinfo(c.TOTAL_TIME), 4),
+        "size_download": int(c.getinfo(SIZE_DOWNLOAD)),
+        "num_connects": c.getinfo(c.NUM_CONNECTS),
+    }
+
+
+def curl(full_url, **kwargs):
+    c = prepare_handle(full_url, **kwargs)
+    try:
+        c.perform()
+    except pycurl.error as e:
+        if not stopped_early(c, e.args[0]):
+            c.close()
+            raise
+    return collect_response(c)
+
+
+def run_concurrently(jobs, concurrency=None):
+    """
+    Run several jobs at the same time on a single pycurl multi-handle.
+
+    Each job is a generator which yields either:
+    - the kwargs of a curl() call, and is then sent back the
+      (code, content, effective_url, timings) tuple
+    - a list of such kwargs, to run all these requests concurrently, and is
+      then sent back the list of tuples (or pycurl.error for failed requests)
+    - a number of seconds to wait before being resumed.
+    Whatever the generator returns is stored as the job's result.
+    """
+
+    concurrency = concurrency or CONCURRENCY
+    multi = pycurl.CurlMulti()
+    results = {}
+    queued = deque()  # (curl kwargs, callback) waiting for a free slot
+    sleeping = []  # heap of (wake up time, tie breaker, job_id)
+    running = {}  # curl handle -> callback
+    tie_breaker = itertools.count()
+
+    def run_group(job_id, requests):
+        responses = [None] * len(requests)
+        remaining = [len(requests)]
+
+        def done(i, response=None, error=None):
+            responses[i] = error or response
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                resume(job_id, response=responses)
+
+        for i, request in enumerate(requests):
+            queued.append((request, lambda r=None, e=None, i=i: done(i, r, e)))
+
+    def resume(job_id, response=None, error=None):
+        try:
+            if error:
+                request = jobs[job_id].throw(error)
+            else:
+                request = jobs[job_id].send(response)
+        except StopIteration as e:
+            results[job_id] = e.value
+            return
+
+        if isinstance(request, (int, float)):
+            wake_up = time.monotonic() + request
+            heapq.heappush(sleeping, (wake_up, next(tie_breaker), job_id))
+        elif isinstance(request, list):
+            if request:
+                run_group(job_id, request)
+            else:
+                resume(job_id, response=[])
+        else:
+            queued.append((request, lambda r=None, e=None: resume(job_id, r, e)))
+
+    for job_id in jobs:
+        resume(job_id)
+
+    while queued or running or sleeping:
+        while sleeping and sleeping[0][0] <= time.monotonic():
+            _, _, job_id = heapq.heappop(sleeping)
+            resume(job_id)
+
+        while queued and len(running) < concurrency:
+            request, callback = queued.popleft()
+            c = prepare_handle(**request)
+            running[c] = callback
+            multi.add_handle(c)
+
+        if not running:
+            if sleeping:
+                time.sleep(max(0, sleeping[0][0] - time.monotonic()))
+            continue
+
+        while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+            pass
+
+        while True:
+            n_remaining, succeeded, failed = multi.info_read()
+            for c in succeeded:
+                multi.remove_handle(c)
+                running.pop(c)(collect_response(c))
+            for c, errno, errmsg in failed:
+                multi.remove_handle(c)
+                if stopped_early(c, errno):
+                    running.pop(c)(collect_response(c))
+                    continue
+                c.close()
+                running.pop(c)(None, pycurl.error(errno, errmsg))
+            if n_remaining == 0:
+                break
+
+        if running:
+            timeout = 1.0
+            if sleeping:
+                timeout = min(timeout, max(0, sleeping[0][0] - time.monotonic()))
+            multi.select(timeout)
+
+    multi.close()
+
+    return results
+
+
+class PageExtractor:
+    """
+    lxml parser target fed with the page as it's being downloaded, keeping only
+    what the test needs (title, base href, assets, and the body text) such that
+    we can stop downloading and parsing as soon as we have it
+    """
+
+    def __init__(self, want_text=False, want_assets=False):
+        self.want_text = want_text
+        self.want_assets = want_assets
+        self.title = None
+        self.base = None
+        self.stylesheets = []
+        self.scripts = []
+        self.other_assets = []
+        self.text = []
+        self.text_size = 0
+        self.pending_text = []
+        self.in_pre = 0
+        self.binary = False
+        self.truncated = False
+        self.done = False
+        self.in_title = False
+        self.in_body = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.parser = etree.HTMLParser(target=self)
+        self.parser.feed("")
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        try:
+            text = self.decoder.decode(chunk)
+        except UnicodeDecodeError:
+            text = "\x00"
+        if "\x00" in text:
+            self.binary = True
+            self.done = True
+            return
+        self.parser.feed(text)
+
+    def finish(self):
+        if not self.binary:
+            self.parser.close()
+
+    @property
+    def content(self):
+        if self.binary:
+            return "(Binary content?)"
+        return "".join(self.text)
+
+    def check_done(self):
+        self.done = (
+            self.in_body
+            and not self.want_text
+            and not self.want_assets
+            and self.text_size >= CONTENT_PREVIEW_SIZE
+        )
+
+    def flush_text(self):
+        # Like BeautifulSoup's get_text(), whitespace-only strings between
+        # tags are squashed into a single newline or space (except in <pre>)
+        text = "".join(self.pending_text)
+        self.pending_text = []
+        if not text:
+            return
+        if not text.strip() and not self.in_pre:
+            text = "\n" if "\n" in text else " "
+        self.text.append(text)
+        self.text_size += len(text)
+        self.check_done()
+
+    # lxml parser target interface
+
+    def start(self, tag, attrib):
+        self.flush_text()
+        if tag in ["pre", "textarea"]:
+            self.in_pre += 1
+        if tag == "title" and self.title is None:
+            self.title = ""
+            self.in_title = True
+        elif tag == "base" and self.base is None:
+            self.base = attrib.get("href", "")
+        elif tag == "link" and "stylesheet" in attrib.get("rel", "").split():
+            if attrib.get("href"):
+                self.stylesheets.append(attrib["href"])
+        elif tag == "link" and {"preload", "modulepreload", "icon"} & set(
+            attrib.get("rel", "").split()
+        ):
+            if attrib.get("href"):
+                self.other_assets.append(attrib["href"])
+        elif tag == "script" and attrib.get("src"):
+            self.scripts.append(attrib["src"])
+        elif tag in ["img", "source", "video", "audio"] and attrib.get("src"):
+            self.other_assets.append(attrib["src"])
+        elif tag == "body":
+            self.in_body = True
+            self.check_done()
+
+    def end(self, tag):
+        self.flush_text()
+        if tag in ["pre", "textarea"]:
+            self.in_pre -= 1
+        if tag == "title":
+            self.in_title = False
+
+    def data(self, data):
+        if self.in_title:
+            self.title += data
+        if self.in_body and (self.want_text or self.text_size < CONTENT_PREVIEW_SIZE):
+            self.pending_text.append(data)
+
+    def close(self):
+        self.flush_text()
+
+
+def sso_login(domain, user=None, password=None):
+    """
+    Return the cookie jar of the SSO session for this domain and user,
+    logging in only if no other test did it already during this run
+    """
+
+    user = user or USER
+    password = password or PASSWORD
+    key = (domain, user)
+    while key in SSO_SESSIONS and SSO_SESSIONS[key] is None:
+        # Another test is logging in right now, wait for it to finish
+        yield 0.05
+    if key in SSO_SESSIONS:
+        return SSO_SESSIONS[key]
+
+    SSO_SESSIONS[key] = None
+    cookies = tempfile.NamedTemporaryFile().name
+    try:
+        code, content, _, _ = yield dict(
+            full_url=f"https://{domain}/yunohost/portalapi/login",
+            save_cookies=cookies,
+            post={"credentials": f"{user}:{password}"},
+        )
+    except pycurl.error:
+        del SSO_SESSIONS[key]
+        raise
+
+    if not (code == 200 and content == "Logged in"):
+        del SSO_SESSIONS[key]
+        raise AssertionError(
+            f"Failed to log in: got code {code} and content: {content}"
+        )
+
+    SSO_SESSIONS[key] = cookies
+    return cookies
+
+
+def invalidate_sso_session(domain, cookies, user=None):
+    user = user or USER
+    # Only drop the session if it's still the one we used, not one another test just opened again
+    if SSO_SESSIONS.get((domain, user)) == cookies:
+        del SSO_SESSIONS[(domain, user)]
+
+
+def css_references(css):
+    """
+    Return the (uri, is_a_stylesheet) referenced by @import and url() in some css
+    """
+
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    imports = re.findall(r"""@import\s+(?:url\(\s*)?["']?([^"')\s;]+)""", css)
+    for uri in imports:
+        yield uri, True
+    for uri in re.findall(r"""url\(\s*["']?([^"')]+?)["']?\s*\)""", css):
+        if uri not in imports and not uri.startswith(("data:", "#")):
+            yield uri, False
+
+
+def fetch_assets(urls, cookies=None):
+    # Fetch (concurrently) the assets nobody fetched yet during this run,
+    # and wait for the ones some other test is currently fetching
+    # (A stylesheet is fully downloaded to look for its references, other assets are only probed)
+    todo = [
+        (url, is_css)
+        for url, is_css in urls
+        if (url, is_css, cookies) not in ASSETS_CACHE
+    ]
+    for url, is_css in todo:
+        ASSETS_CACHE[(url, is_css, cookies)] = None
+
+    responses = yield [
+        dict(full_url=url, use_cookies=cookies, probe=not is_css)
+        for url, is_css in todo
+    ]
+
+    for (url, is_css), response in zip(todo, responses):
+        if isinstance(response, pycurl.error):
+            code, effective_url, references, timings = None, url, [], None
+        else:
+            code, content, effective_url, timings = response
+            references = []
+            if is_css and code in ASSET_OK_CODES:
+                for uri, imported in css_references(content):
+                    valid, resolved = validate_and_normalize(effective_url, "", uri)
+                    if valid:
+                        references.append((resolved, imported))
+        ASSETS_CACHE[(url, is_css, cookies)] = (
+            code,
+            effective_url,
+            references,
+            timings,
+        )
+
+    while any(ASSETS_CACHE[(url, is_css, cookies)] is None for url, is_css in urls):
+        yield 0.05
+
+
+def check_assets(urls, cookies=None, follow_css=False):
+    """
+    Check a list of (url, is_a_stylesheet), and if follow_css is set, all the
+    assets referenced by these stylesheets too.
+    Returns a list of (url, code, effective_url, referenced_by, timings)
+    """
+
+    referenced_by = {url: None for url, _ in urls}
+    to_check = list(urls)
+    checked = []
+    while to_check:
+        yield from fetch_assets(to_check, cookies)
+        next_to_check = []
+        for url, is_css in to_check:
+            code, effective_url, references, timings = ASSETS_CACHE[
+                (url, is_css, cookies)
+            ]
+            checked.append((url, code, effective_url, referenced_by[url], timings))
+            if not follow_css:
+                continue
+            for reference, is_css in references:
+                if reference not in referenced_by:
+                    referenced_by[reference] = url
+                    next_to_check.append((reference, is_css))
+        to_check = next_to_check
+
+    return checked
 
 
 def validate_and_normalize(effective_url, base, uri):
@@ -130,45 +609,73 @@ def test(
     expect_title=None,
     expect_effective_url=None,
     auto_test_assets=False,
+    ready_timeout=30,
+    expect_max_ttfb=None,
+    expect_max_total_time=None,
 ):
+    # NB: this is a job for run_concurrently(), hence the yields instead of curl() calls
     domain = base_url.replace("https://", "").replace("http://", "").split("/")[0]
     if logged_on_sso:
-        cookies = tempfile.NamedTemporaryFile().name
-
-        code, content, _ = curl(
-            f"https://{domain}/yunohost/portalapi/login",
-            save_cookies=cookies,
-            post={"credentials": f"{USER}:{PASSWORD}"},
-        )
-        assert (
-            code == 200 and content == "Logged in"
-        ), f"Failed to log in: got code {code} and content: {content}"
+        cookies = yield from sso_login(domain)
     else:
         cookies = None
 
     full_url = base_url + path
-    code = None
-    retried = 0
-    while code is None or code in {502, 503, 504}:
-        time.sleep(retried * 5)
-        code, content, effective_url = curl(full_url, post=post, use_cookies=cookies)
-        retried += 1
-        if retried > 3:
+
+    # Poll the app until it stops answering 502/503/504 (or refusing connections),
+    # backing off exponentially (with jitter) up to the ready_timeout deadline
+    start = time.monotonic()
+    deadline = start + ready_timeout
+    delay = READY_POLL_MIN_DELAY
+    polls = 0
+    last_error = None
+    while True:
+        polls += 1
+        page = PageExtractor(
+            want_text=bool(expect_content), want_assets=auto_test_assets
+        )
+        try:
+            code, content, effective_url, timings = yield dict(
+                full_url=full_url, post=post, use_cookies=cookies, page=page
+            )
+        except pycurl.error as e:
+            if time.monotonic() >= deadline:
+                raise
+            code, timings, last_error = None, None, e
+        remaining = deadline - time.monotonic()
+        if code not in {None, 502, 503, 504} or remaining <= 0:
             break
+        yield min(remaining, random.uniform(delay / 2, delay))
+        delay = min(delay * 2, READY_POLL_MAX_DELAY)
 
-    html = BeautifulSoup(content, features="lxml")
+    # Never got an answer at all before the deadline
+    if code is None:
+        raise last_error
 
-    try:
-        title = html.find("title").string
-        title = title.strip().replace("\u2013", "-")
-    except Exception:
-        title = ""
+    time_to_ready = (
+        round(time.monotonic() - start, 3) if code not in {502, 503, 504} else None
+    )
+
+    if logged_on_sso and "/yunohost/sso" in effective_url:
+        # The portal rejected our (shared) session, log in again and retry once
+        invalidate_sso_session(domain, cookies)
+        cookies = yield from sso_login(domain)
+        page = PageExtractor(
+            want_text=bool(expect_content), want_assets=auto_test_assets
+        )
+        code, content, effective_url, timings = yield dict(
+            full_url=full_url, post=post, use_cookies=cookies, page=page
+        )
 
-    content = html.find("body")
-    content = content.get_text().strip() if content else ""
-    content = re.sub(r"[\t\n\s]{3,}", "\n\n", content)
-    base_tag = html.find("base")
-    base = base_tag.get("href", "") if base_tag else ""
+    warnings = []
+    if page.truncated:
+        warnings.append(
+            f"The page is bigger than {MAX_BODY_SIZE} bytes, only the beginning of it was checked (cf CURL_TESTS_MAX_BODY_SIZE)"
+        )
+
+    title = (page.title or "").strip().replace("\u2013", "-")
+    content = re.sub(r"[\t\n\s]{3,}", "\n\n", content.strip())
+    base = page.base or ""
 
     def code_was_expected(code: int) -> bool:
         if isinstance(expect_return_code, int):
@@ -202,56 +709,68 @@ def test(
         errors.append(
             f"Did not find pattern '{expect_content}' in the page content: '{content[:50]}' (on URL {effective_url})"
         )
+    if expect_max_ttfb is not None and timings["ttfb"] > expect_max_ttfb:
+        errors.append(
+            f"Took {timings['ttfb']:.2f}s to get the first byte of the page, but was expecting at most {expect_max_ttfb}s"
+        )
+    if expect_max_total_time is not None and timings["total"] > expect_max_total_time:
+        errors.append(
+            f"Took {timings['total']:.2f}s to get the page, but was expecting at most {expect_max_total_time}s"
+        )
 
     assets = []
     # Auto-check assets - though skip this if we have an unexpected return code for the main page, because there's very likely no asset to find
     if auto_test_assets and code_was_expected(code):
-        assets_to_check = []
-        stylesheets = html.find_all("link", rel="stylesheet", href=True)
-        stylesheets = [
-            s["href"]
-            for s in stylesheets
-            if "ynh_portal" not in s["href"]
-            and "ynhtheme" not in s["href"]
-            and "ynh_overlay" not in s["href"]
-        ]
-        if stylesheets:
-            for sheet in stylesheets:
-                valid, uri = validate_and_normalize(effective_url, base, sheet)
-                if not valid:
-                    continue
-                assets_to_check.append(uri)
-                break
+        check_all = auto_test_assets == "all"
 
-        js = html.find_all("script", src=True)
-        js = [
-            s["src"]
-            for s in js
-            if "ynh_portal" not in s["src"]
-            and "ynhtheme" not in s["src"]
-            and "ynh_overlay" not in s["src"]
-        ]
-        if js:
-            for js in js:
-                valid, uri = validate_and_normalize(effective_url, base, js)
-                if not valid:
+        def same_origin_assets(uris):
+            for uri in uris:
+                if any(ynh_asset in uri for ynh_asset in YNH_ASSETS):
                     continue
-                assets_to_check.append(uri)
-                break
+                valid, resolved = validate_and_normalize(effective_url, base, uri)
+                if valid:
+                    yield resolved
+
+        stylesheets = list(same_origin_assets(page.stylesheets))
+        js = list(same_origin_assets(page.scripts))
+        if check_all:
+            # Every asset of the page, and those referenced in its css
+            others = list(same_origin_assets(page.other_assets))
+            assets_to_check = [(url, True) for url in stylesheets]
+            assets_to_check += [(url, False) for url in js + others]
+            assets_to_check = list(dict.fromkeys(assets_to_check))
+        else:
+            # Only the first stylesheet and the first script
+            assets_to_check = [(url, True) for url in stylesheets[:1]]
+            assets_to_check += [(url, False) for url in js[:1]]
 
         if not assets_to_check:
-            print(
-                "\033[1m\033[93mWARN\033[0m auto_test_assets set to true, but no js/css asset found in this page"
-            )
-        for resolved_asset_url in assets_to_check:
-            asset_code, _, effective_asset_url = curl(
-                resolved_asset_url, use_cookies=cookies
+            warnings.append(
+                "auto_test_assets set to true, but no js/css asset found in this page"
             )
-            if asset_code != 200:
+
+        checked = yield from check_assets(
+            assets_to_check, cookies=cookies, follow_css=check_all
+        )
+        for (
+            asset_url,
+            asset_code,
+            effective_asset_url,
+            referenced_by,
+            asset_timings,
+        ) in checked:
+            if asset_code not in ASSET_OK_CODES:
+                derived_from = (
+                    f"referenced by the stylesheet {referenced_by}"
+                    if referenced_by
+                    else "automatically derived from the page's html"
+                )
                 errors.append(
-                    f"Asset {resolved_asset_url} (automatically derived from the page's html) answered with code {asset_code}, expected 200? Effective url: {effective_asset_url}"
+                    f"Asset {asset_url} ({derived_from}) answered with code {asset_code}, expected 200? Effective url: {effective_asset_url}"
                 )
-            assets.append((resolved_asset_url, asset_code))
+            assets.append(
+                {"url": asset_url, "code": asset_code, "timings": asset_timings}
+            )
 
     return {
         "url": full_url,
@@ -260,12 +779,165 @@ def test(
         "title": title,
         "content": content,
         "assets": assets,
+        "warnings": warnings,
         "errors": errors,
+        "time_to_ready": time_to_ready,
+        "polls": polls,
+        "timings": timings,
     }
 
 
+def load_test(
+    full_url,
+    expect_return_code=200,
+    post=None,
+    cookies=None,
+    concurrency=LOAD_DEFAULT_CONCURRENCY,
+    duration=LOAD_DEFAULT_DURATION,
+    max_error_rate=0,
+):
+    """
+    Keep `concurrency` requests in flight on the URL for `duration` seconds
+    (on a multi-handle of its own, not to share the concurrency limit of the
+    functional tests) and return throughput, latency percentiles and the
+    distribution of the return codes
+    """
+
+    multi = pycurl.CurlMulti()
+    latencies = []
+    codes = Counter()
+    in_flight = 0
+    start = time.monotonic()
+
+    while True:
+        while in_flight < concurrency and time.monotonic() < start + duration:
+            c = prepare_handle(full_url, post=post, use_cookies=cookies, discard=True)
+            multi.add_handle(c)
+            in_flight += 1
+
+        if not in_flight:
+            break
+
+        while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+            pass
+
+        while True:
+            n_remaining, succeeded, failed = multi.info_read()
+            for c in succeeded:
+                codes[str(c.getinfo(c.RESPONSE_CODE))] += 1
+            for c, errno, errmsg in failed:
+                if stopped_early(c, errno):
+                    codes[str(c.getinfo(c.RESPONSE_CODE))] += 1
+                else:
+                    codes[f"curl error {errno}"] += 1
+            for c in succeeded + [c for c, _, _ in failed]:
+                latencies.append(c.getinfo(c.TOTAL_TIME))
+                multi.remove_handle(c)
+                c.close()
+                in_flight -= 1
+            if n_remaining == 0:
+                break
+
+        if in_flight:
+            multi.select(1.0)
+
+    multi.close()
+    elapsed = time.monotonic() - start
+
+    expected_codes = {
+        str(code)
+        for code in (
+            expect_return_code
+            if isinstance(expect_return_code, list)
+            else [expect_return_code]
+        )
+    }
+    n_errors = sum(n for code, n in codes.items() if code not in expected_codes)
+    latencies.sort()
+    if not latencies:
+        return {"concurrency": concurrency, "requests": 0}, [
+            "The load test didn't perform any request"
+        ]
+
+    def percentile(p):
+        # (nearest-rank method)
+        return round(latencies[max(0, -(-len(latencies) * p // 100) - 1)], 4)
+
+    stats = {
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "latency_p50": percentile(50),
+        "latency_p95": percentile(95),
+        "latency_p99": percentile(99),
+        "codes": dict(codes),
+        "error_rate": round(n_errors / len(latencies), 4),
+    }
+
+    errors = []
+    if stats["error_rate"] > max_error_rate:
+        errors.append(
+            f"{n_errors} out of {len(latencies)} requests failed during the load test ({', '.join(f'{code}: {n}' for code, n in codes.items())}), but was expecting an error rate of at most {max_error_rate}"
+        )
+
+    return stats, errors
+
+
+def guarded(full_url, job):
+    # Don't let a single crashing test (e.g. failed SSO login, connection refused)
+    # take down the other tests running at the same time
+    try:
+        return (yield from job)
+    except (AssertionError, pycurl.error) as e:
+        return {
+            "url": full_url,
+            "effective_url": full_url,
+            "code": None,
+            "title": "",
+            "content": "",
+            "assets": [],
+            "warnings": [],
+            "errors": [f"The test crashed: {e}"],
+            "time_to_ready": None,
+            "polls": 0,
+            "timings": None,
+        }
+
+
+def with_valid_load(load, job):
+    # (Checked from within the job, such that an invalid load table is reported
+    # as an error of that test by guarded(), and its load test is skipped)
+    assert isinstance(
+        load, dict
+    ), "load should be a table like { concurrency = 20, duration = 30 }"
+    unknown = set(load) - {"concurrency", "duration", "max_error_rate"}
+    assert not unknown, f"Unknown key(s) in load: {', '.join(sorted(unknown))}"
+    concurrency = load.get("concurrency", LOAD_DEFAULT_CONCURRENCY)
+    assert (
+        isinstance(concurrency, int)
+        and not isinstance(concurrency, bool)
+        and concurrency > 0
+    ), "load.concurrency should be a positive integer"
+    duration = load.get("duration", LOAD_DEFAULT_DURATION)
+    assert (
+        isinstance(duration, (int, float))
+        and not isinstance(duration, bool)
+        and duration > 0
+    ), "load.duration should be a positive number of seconds"
+    max_error_rate = load.get("max_error_rate", 0)
+    assert (
+        isinstance(max_error_rate, (int, float))
+        and not isinstance(max_error_rate, bool)
+        and 0 <= max_error_rate <= 1
+    ), "load.max_error_rate should be a number between 0 and 1"
+    return (yield from job)
+
+
 def run(tests):
-    results = {}
+    jobs = {}
+    noslash_twins = {}
+    loads = {}
 
     for name, params in tests.items():
         full_params = DEFAULTS.copy()
@@ -276,22 +948,67 @@ def run(tests):
                     "__DOMAIN__", APP_DOMAIN
                 )
 
-        results[name] = test(**full_params)
-        display_result(results[name])
+        load = full_params.pop("load", None)
+        full_url = full_params["base_url"] + full_params["path"]
+        if load is not None:
+            loads[name] = (full_params.copy(), load)
+            jobs[name] = guarded(full_url, with_valid_load(load, test(**full_params)))
+        else:
+            jobs[name] = guarded(full_url, test(**full_params))
 
         if full_params["path"] == "/":
             full_params["path"] = ""
-            results[name + "_noslash"] = test(**full_params)
+            full_url = full_params["base_url"]
+            jobs[name + "_noslash"] = guarded(full_url, test(**full_params))
+            noslash_twins[name + "_noslash"] = name
 
-            # Display this result too, but only if there's really a difference compared to the regular test
-            # because 99% of the time it's the same as the regular test
-            if (
-                results[name + "_noslash"]["effective_url"]
-                != results[name]["effective_url"]
-            ):
-                display_result(results[name + "_noslash"])
+    results = run_concurrently(jobs)
 
-    return results
+    # Load tests are ran one after the other, only once the functional tests are done
+    # (and passed), such that they don't interfere with each other
+    for name, (params, load) in loads.items():
+        result = results[name]
+        if result["errors"]:
+            continue
+        domain = urlparse(result["url"]).netloc
+        result["load"], errors = load_test(
+            result["url"],
+            expect_return_code=params["expect_return_code"],
+            post=params.get("post"),
+            cookies=(
+                SSO_SESSIONS.get((domain, USER)) if params["logged_on_sso"] else None
+            ),
+            **load,
+        )
+        result["errors"] += errors
+
+    # Display in the order the tests were declared, whatever order they finished in
+    for name in jobs:
+        # Display the _noslash results too, but only if there's really a difference compared to the regular test
+        # because 99% of the time it's the same as the regular test
+        twin = noslash_twins.get(name)
+        if twin and results[name]["effective_url"] == results[twin]["effective_url"]:
+            continue
+        display_result(results[name])
+
+    return {name: results[name] for name in jobs}
+
+
+def format_timings(timings):
+    def ms(seconds):
+        return f"{seconds * 1000:.0f}ms"
+
+    return ", ".join(
+        [
+            f"dns {ms(timings['namelookup'])}",
+            f"connect {ms(timings['connect'])}",
+            f"tls {ms(timings['appconnect'])}" if timings["appconnect"] else "no tls",
+            f"ttfb {ms(timings['ttfb'])}",
+            f"total {ms(timings['total'])}",
+            f"{timings['size_download'] / 1024:.1f}KB",
+            f"{timings['num_connects']} new connection(s)",
+        ]
+    )
 
 
 def display_result(result):
@@ -305,14 +1022,41 @@ def display_result(result):
         print(f"Code    : {result['code']}")
     if result["title"].strip():
         print(f"Title   : {result['title'].strip()}")
+    if result["polls"] > 1:
+        if result["time_to_ready"] is not None:
+            print(
+                f"Ready   : after {result['time_to_ready']:.1f}s ({result['polls']} polls)"
+            )
+        else:
+            print(f"Ready   : never ({result['polls']} polls)")
+    if result["timings"]:
+        print(f"Timings : {format_timings(result['timings'])}")
     print(f"Content extract:\n{result['content'][:100].strip()}")
+    if result.get("load", {}).get("requests"):
+        load = result["load"]
+        codes = ", ".join(f"{code} x{n}" for code, n in load["codes"].items())
+        print(
+            f"Load    : {load['requests']} requests in {load['duration']:.1f}s with {load['concurrency']} concurrent clients ({load['throughput']:.1f} req/s)"
+        )
+        print(
+            f"          latency p50 {load['latency_p50'] * 1000:.0f}ms / p95 {load['latency_p95'] * 1000:.0f}ms / p99 {load['latency_p99'] * 1000:.0f}ms, codes: {codes}"
+        )
+    for warning in result["warnings"]:
+        print(f"\033[1m\033[93mWARN\033[0m {warning}")
     if result["assets"]:
         print("Assets  :")
-        for asset, code in result["assets"]:
-            if code == 200:
-                print(f"  - {asset}")
+        for asset in result["assets"]:
+            took = (
+                f" ({asset['timings']['total'] * 1000:.0f}ms)"
+                if asset["timings"]
+                else ""
+            )
+            if asset["code"] in ASSET_OK_CODES:
+                print(f"  - {asset['url']}{took}")
             else:
-                print(f"  - \033[1m\033[91mFAIL\033[0m (code {code}) {asset}")
+                print(
+                    f"  - \033[1m\033[91mFAIL\033[0m (code {asset['code']}) {asset['url']}{took}"
+                )
     if result["errors"]:
         print("Errors  :\n    - " + "\n    - ".join(result["errors"]))
         print("\033[1m\033[91mFAIL\033[0m")
@@ -321,8 +1065,28 @@ def display_result(result):
     print("========")
 
 
-def main():
-    tests = sys.stdin.read()
+def save_results(path, results):
+    # The same test may validate the app several times (e.g. after install and after reinstall)
+    # so we append this validation to the previous ones
+    validations = json.load(open(path)) if os.path.exists(path) else []
+    validations.append(
+        {
+            "base_url": BASE_URL,
+            "timestamp": int(time.time()),
+            "results": {
+                name: {key: value for key, value in result.items() if key != "content"}
+                for name, result in results.items()
+            },
+        }
+    )
+    json.dump(validations, open(path, "w"), indent=4)
+
+
+def validate(tests, environ):
+    """
+    Run the tests described in TOML, and return the exit code of the validation
+    """
+    configure(environ)
 
     if not tests.strip():
         tests = "home.path = '/'"
@@ -331,13 +1095,79 @@ def main():
     tests = toml.loads(tests)
     results = run(tests)
 
+    # Keep a machine-readable copy of the results (with all the timings) for later analysis
+    if environ.get("CURL_TESTS_RESULTS"):
+        save_results(environ["CURL_TESTS_RESULTS"], results)
+
     # If there was at least one error 50x
     if any(str(r["code"]).startswith("5") for r in results.values()):
-        sys.exit(5)
+        return 5
     elif any(r["errors"] for r in results.values()):
-        sys.exit(1)
+        return 1
+    else:
+        return 0
+
+
+class ValidationRequest(socketserver.StreamRequestHandler):
+    """
+    A validation sent by curl_tests_client.py: a JSON line with the tests and
+    the environment, answered with the display of the results, then a NUL
+    byte followed by the exit code
+    """
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        sys.stdout = io.TextIOWrapper(self.wfile, line_buffering=True)
+        try:
+            exit_code = validate(request["tests"], request["environ"])
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            exit_code = 1
+        sys.stdout.flush()
+        self.wfile.write(b"\0%d" % exit_code)
+
+
+class ValidationWorker(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Each validation runs in a fork of the worker, which already has python,
+    pycurl, lxml, toml and the compiled regexes loaded, while nothing (SSO
+    sessions, assets cache...) leaks from a validation to the next one, the
+    app having been reinstalled / restored / moved in between
+    """
+
+    def service_actions(self):
+        super().service_actions()
+        # Don't outlive package_check
+        if os.getppid() != self.parent_pid:
+            sys.exit(0)
+
+
+def serve(socket_path):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with ValidationWorker(socket_path, ValidationRequest) as worker:
+        worker.parent_pid = os.getppid()
+        try:
+            worker.serve_forever(poll_interval=1)
+        finally:
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Keep running as a worker validating the requests of curl_tests_client.py on this unix socket",
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
     else:
-        sys.exit(0)
+        sys.exit(validate(sys.stdin.read(), os.environ))
 
 
-main()
+if __name__ == "__main__":
+    main()
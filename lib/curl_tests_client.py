@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Thin client of the curl tests worker (cf serve() in curl_tests.py), with the
+# same interface as curl_tests.py (tests on stdin, config in the environment,
+# results on stdout and same exit code) but without paying for the startup of
+# pycurl, lxml & co on each validation. Falls back to running curl_tests.py if
+# there's no worker.
+
+import json
+import os
+import socket
+import subprocess
+import sys
+
+SOCKET = os.environ.get("CURL_TESTS_SOCKET", "")
+
+
+def main():
+    tests = sys.stdin.read()
+
+    try:
+        worker = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        worker.connect(SOCKET)
+    except OSError:
+        curl_tests = os.path.join(os.path.dirname(__file__), "curl_tests.py")
+        return subprocess.run(
+            [sys.executable, curl_tests], input=tests, text=True
+        ).returncode
+
+    output = sys.stdout.buffer
+    exit_code = None
+    with worker:
+        request = {"tests": tests, "environ": dict(os.environ)}
+        worker.sendall(json.dumps(request).encode() + b"\n")
+        while chunk := worker.recv(65536):
+            if exit_code is not None:
+                exit_code += chunk
+                continue
+            if b"\0" in chunk:
+                chunk, exit_code = chunk.split(b"\0", 1)
+            output.write(chunk)
+            output.flush()
+
+    if not exit_code:
+        print("The curl tests worker died during the validation ?!", file=sys.stderr)
+        return 1
+    return int(exit_code)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Everything LXC_EXEC runs goes through this, once: the output is appended as-is
+# to the log files, (optionally) printed without the debug noise, and summarized
+# on the fly in a JSON digest of the test (warnings, manually modified files,
+# errors...), so that nothing has to re-read logs which can be *huge* (npm,
+# cargo, ...) afterwards.
+#
+#   some_command | python3 lib/log_analyzer.py --digest digest.json [--filter-debug] log1 [log2...]
+
+import argparse
+import json
+import os
+import re
+import sys
+
+# The patterns are applied to whole blocks of lines at once rather than line by
+# line (which is way too slow in Python). They start with the line break ending
+# the previous line rather than with a ^ in multiline mode, because looking for
+# a literal is much faster (and blocks are analyzed with an extra leading \n)
+DEBUG_LINE = re.compile(
+    rb"\n(?:[0-9]+[^\S\n]+.{1,15}DEBUG|[^\n]*processing action)[^\n]*"
+)
+WARNING = re.compile(rb"\n[0-9]+[^\S\n]+.{1,15}WARNING")
+# (The helpers don't quote the path, but some versions of the message did)
+MANUALLY_MODIFIED = re.compile(
+    rb"'?(\S+?)'? has been manually modified since the installation or last upgrade\. So it has been duplicated"
+)
+ERRORS = [
+    re.compile(rb"\n[0-9]+[^\S\n]+.{1,15}ERROR[^\S\n]*([^\n]*)"),
+    re.compile(rb"\n(?:\x1b\[[0-9;]*m)*(Error: [^\n]*)"),
+    re.compile(rb"\n(Traceback \(most recent call last\)[^\n]*)"),
+    re.compile(rb"\n(npm ERR! [^\n]*)"),
+    re.compile(rb"\n(error(?:\[E[0-9]+\])?: [^\n]*)"),
+]
+ANSI_ESCAPE = re.compile(rb"\x1b\[[0-9;]*m")
+NUMBERS = re.compile(r"[0-9]+")
+
+# To keep a constant memory footprint whatever the size of the output
+MAX_ERROR_SIGNATURES = 20
+MAX_MANUALLY_MODIFIED = 20
+MAX_SIGNATURE_LENGTH = 200
+CHUNK_SIZE = 65536
+# (e.g. progress bars only made of \r, which never end their line)
+MAX_LINE_LENGTH = 16 * CHUNK_SIZE
+
+
+def new_digest():
+    return {
+        "lines": 0,
+        "bytes": 0,
+        "warnings": 0,
+        "manually_modified": [],
+        "errors": [],
+        "other_errors": 0,
+    }
+
+
+def analyze(fd, logs, output, digest, filter_debug):
+    errors = {e["signature"]: e for e in digest["errors"]}
+    try:
+        _analyze(fd, logs, output, digest, errors, filter_debug)
+    finally:
+        digest["errors"] = list(errors.values())
+    return digest
+
+
+def _analyze(fd, logs, output, digest, errors, filter_debug):
+    # Read whatever is available (rather than line by line) so that the output
+    # is still displayed live, without paying a write+flush for every line
+    pending = b""
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        for log in logs:
+            log.write(chunk)
+            log.flush()
+
+        if not chunk:
+            # The last line may not have a line break
+            block, pending = pending, b""
+        else:
+            # Only the complete lines, the end of the last one will come later
+            data = pending + chunk
+            end = data.rfind(b"\n") + 1
+            if len(data) - end > MAX_LINE_LENGTH:
+                end = len(data)
+            block, pending = data[:end], data[end:]
+
+        if block:
+            block = b"\n" + block
+            analyze_block(block, digest, errors)
+            if filter_debug and (b"DEBUG" in block or b"processing action" in block):
+                block = DEBUG_LINE.sub(b"", block)
+            if output and len(block) > 1:
+                output.write(block[1:])
+                output.flush()
+
+        if not chunk:
+            return
+
+
+def manually_modified_files(block):
+    """
+    (Run with: python3 -m doctest lib/log_analyzer.py)
+
+    >>> manually_modified_files(
+    ...     b"\\n2024-05-11 15:08:42,362: WARNING - File /etc/nginx/conf.d/domain.tld.d/app.conf"
+    ...     b" has been manually modified since the installation or last upgrade. So it has been"
+    ...     b" duplicated in /var/cache/yunohost/appconfbackup//etc/nginx/conf.d/domain.tld.d/app.conf.backup.20240511.150842"
+    ...     b"\\nFile '/etc/php/8.2/fpm/pool.d/app.conf' has been manually modified since the"
+    ...     b" installation or last upgrade. So it has been duplicated in /var/cache/yunohost/appconfbackup/"
+    ... )
+    ['/etc/nginx/conf.d/domain.tld.d/app.conf', '/etc/php/8.2/fpm/pool.d/app.conf']
+    """
+    return [
+        match.group(1).decode(errors="replace")
+        for match in MANUALLY_MODIFIED.finditer(block)
+    ]
+
+
+def analyze_block(block, digest, errors):
+    # (block starts with an extra \n, cf the patterns)
+    first_line = digest["lines"] + 1
+    digest["lines"] += block.count(b"\n") - 1
+    digest["bytes"] += len(block) - 1
+
+    if b"WARNING" in block:
+        digest["warnings"] += len(WARNING.findall(block))
+
+    if b"manually modified" in block:
+        for path in manually_modified_files(block):
+            if (
+                path not in digest["manually_modified"]
+                and len(digest["manually_modified"]) < MAX_MANUALLY_MODIFIED
+            ):
+                digest["manually_modified"].append(path)
+
+    # (A line may match several patterns, but it's still one error)
+    matches = {}
+    if b"rror" in block or b"ERR" in block or b"Traceback" in block:
+        for pattern in ERRORS:
+            for match in pattern.finditer(block):
+                matches.setdefault(match.start(), match)
+
+    for position, match in sorted(matches.items()):
+        message = ANSI_ESCAPE.sub(b"", match.group(1)).decode(errors="replace")
+        message = message.strip()
+        # Similar errors only differing by some id, size, line number... are the same
+        signature = NUMBERS.sub("N", message)[:MAX_SIGNATURE_LENGTH]
+        if signature in errors:
+            errors[signature]["count"] += 1
+        elif len(errors) < MAX_ERROR_SIGNATURES:
+            errors[signature] = {
+                "signature": signature,
+                "first_occurrence": message[:MAX_SIGNATURE_LENGTH],
+                "line": first_line + block.count(b"\n", 0, position),
+                "count": 1,
+            }
+        else:
+            digest["other_errors"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="*", help="Log files to append the output to")
+    parser.add_argument(
+        "--digest",
+        help="JSON digest of the test, updated with what's found in this output",
+    )
+    parser.add_argument(
+        "--filter-debug",
+        action="store_true",
+        help="Don't print the DEBUG and 'processing action' lines (they're still logged)",
+    )
+    args = parser.parse_args()
+
+    digest = new_digest()
+    if args.digest and os.path.exists(args.digest):
+        digest.update(json.load(open(args.digest)))
+
+    logs = [open(log, "ab") for log in args.logs if log]
+    try:
+        analyze(sys.stdin.fileno(), logs, sys.stdout.buffer, digest, args.filter_debug)
+    except BrokenPipeError:
+        # Whoever reads our output went away, still log and analyze everything
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        analyze(sys.stdin.fileno(), logs, None, digest, args.filter_debug)
+    finally:
+        for log in logs:
+            log.close()
+
+    if args.digest:
+        json.dump(digest, open(args.digest, "w"))
+
+
+if __name__ == "__main__":
+    main()
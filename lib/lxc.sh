@@ -1,4 +1,5 @@
 #!/bin/bash
+# shellcheck disable=SC2155
 
 # Check for LXC or Incus
 function switch_lxc_incus()
@@ -23,34 +24,44 @@ switch_lxc_incus
 
 LXC_CREATE () {
     log_info "Launching new LXC $LXC_NAME ..."
-    # Check if we can launch container from YunoHost remote image
-    if $lxc remote list | grep -q "yunohost" && $lxc image list "yunohost:$LXC_BASE" | grep -q -w "$LXC_BASE"; then
-        # Force the usage of the fingerprint because otherwise for some reason lxd won't use the newer version
-        # available even though it's aware it exists -_-
-        LXC_BASE_HASH="$($lxc image list "yunohost:$LXC_BASE" --format json | jq -r '.[].fingerprint')"
-        $lxc launch "yunohost:$LXC_BASE_HASH" "$LXC_NAME" \
-            -c security.nesting=true \
-            -c security.privileged=true \
-            -c limits.memory=80% \
-            -c limits.cpu.allowance=80% \
-            >>/proc/self/fd/3
-    # Check if we can launch container from a local image
-    elif $lxc image list "$LXC_BASE" | grep -q -w "$LXC_BASE"; then
-        $lxc launch "$LXC_BASE" "$LXC_NAME" \
-            -c security.nesting=true \
-            -c security.privileged=true \
-            -c limits.memory=80% \
-            -c limits.cpu.allowance=80% \
-            >>/proc/self/fd/3
-    else
-        log_critical "Can't find base image $LXC_BASE, run ./package_check.sh --rebuild"
+    local image
+    local base_fingerprint
+    _LXC_FIND_BASE_IMAGE
+
+    # Reuse the initial state of a previous run with the same base image and apt dependencies, if any
+    SNAPSHOT_CACHE_HIT=false
+    local cache_alias=""
+    if [[ "$SNAPSHOT_CACHE" == "true" ]] && [[ -n "$(_APT_DEPS_TO_PREINSTALL)" ]]; then
+        cache_alias="$(_SNAPSHOT_CACHE_ALIAS "$base_fingerprint")"
+        if _SNAPSHOT_CACHE_LOOKUP "$cache_alias"; then
+            image="$cache_alias"
+            SNAPSHOT_CACHE_HIT=true
+        fi
+        _SNAPSHOT_CACHE_REPORT "$cache_alias"
+    fi
+
+    # In batch mode, the container may have been launched in advance from the base image (cf LXC_POOL_FILL)
+    local launch_start=$EPOCHREALTIME
+    local pool_status="none"
+    if [[ -n "${LXC_FROM_POOL:-}" ]]; then
+        if [[ "$SNAPSHOT_CACHE_HIT" == "false" ]] && [[ "$LXC_FROM_POOL" == "$base_fingerprint" ]]; then
+            pool_status="hit"
+            log_info "(Using $LXC_NAME, launched in advance from the base image)"
+        else
+            pool_status="miss"
+            LXC_RESET
+        fi
     fi
 
-    pipestatus="${PIPESTATUS[0]}"
-    location=$($lxc list --format json | jq -e --arg LXC_NAME "$LXC_NAME" '.[] | select(.name==$LXC_NAME) | .location' | tr -d '"')
-    [[ "$location" != "none" ]] && log_info "... on $location"
+    if [[ "$pool_status" != "hit" ]]; then
+        _LXC_LAUNCH "$image" "$LXC_NAME"
+
+        pipestatus=$?
+        location=$($lxc list --format json | jq -e --arg LXC_NAME "$LXC_NAME" '.[] | select(.name==$LXC_NAME) | .location' | tr -d '"')
+        [[ "$location" != "none" ]] && log_info "... on $location"
 
-    [[ "$pipestatus" -eq 0 ]] || exit 1
+        [[ "$pipestatus" -eq 0 ]] || exit 1
+    fi
 
     if [[ "$($lxc list "$LXC_NAME" --format json)" == "[]" ]]
     then
@@ -58,16 +69,16 @@ LXC_CREATE () {
     fi
 
     _LXC_START_AND_WAIT "$LXC_NAME"
-    sleep 3
+    local launched_at=$EPOCHREALTIME
 
     if ! $lxc exec "$LXC_NAME" -- test -e /etc/yunohost
     then
          log_critical "Failed to run 'test -e /etc/yunohost' on the container ... either the container did not start, or YunoHost doesn't exists yet in the container :/"
     fi
 
+    _APT_CACHE_SETUP
     _STUFF_TO_RUN_BEFORE_INITIAL_SNAPSHOT
 
-    sleep 3
     log_info "Creating initial snapshot $LXC_NAME ..."
     if [[ "$lxc" == "lxc" ]]; then
         $lxc snapshot "$LXC_NAME" snap0
@@ -79,6 +90,214 @@ LXC_CREATE () {
     then
         log_critical "Failed to create the initial snapshot :/"
     fi
+
+    if [[ -n "$cache_alias" ]] && [[ "$SNAPSHOT_CACHE_HIT" == "false" ]]
+    then
+        _SNAPSHOT_CACHE_STORE "$cache_alias"
+    fi
+
+    # (For the reports of the batch mode)
+    jq -nc --arg pool "$pool_status" --argjson t0 "$launch_start" --argjson t1 "$launched_at" --argjson ready_at "$EPOCHREALTIME" \
+        '{$pool, launch: (($t1 - $t0) * 100 | round / 100), $ready_at}' > "$TEST_CONTEXT/lxc_create.json"
+}
+
+_LXC_FIND_BASE_IMAGE() {
+    # Sets $image and $base_fingerprint, for the caller
+    # Check if we can launch container from YunoHost remote image
+    if $lxc remote list | grep -q "yunohost" && $lxc image list "yunohost:$LXC_BASE" | grep -q -w "$LXC_BASE"; then
+        # Force the usage of the fingerprint because otherwise for some reason lxd won't use the newer version
+        # available even though it's aware it exists -_-
+        LXC_BASE_HASH="$($lxc image list "yunohost:$LXC_BASE" --format json | jq -r '.[].fingerprint')"
+        image="yunohost:$LXC_BASE_HASH"
+        base_fingerprint="$LXC_BASE_HASH"
+    # Check if we can launch container from a local image
+    elif $lxc image list "$LXC_BASE" | grep -q -w "$LXC_BASE"; then
+        image="$LXC_BASE"
+        base_fingerprint="$($lxc image list "$LXC_BASE" --format json | jq -r --arg LXC_BASE "$LXC_BASE" '.[] | select(any(.aliases[]; .name==$LXC_BASE)) | .fingerprint')"
+    else
+        log_critical "Can't find base image $LXC_BASE, run ./package_check.sh --rebuild"
+    fi
+}
+
+_LXC_LAUNCH() {
+    local image=$1
+    local container=$2
+    $lxc launch "$image" "$container" \
+        -c security.nesting=true \
+        -c security.privileged=true \
+        -c limits.memory=80% \
+        -c limits.cpu.allowance=80% \
+        >>/proc/self/fd/3
+}
+
+#=================================================
+# CONTAINER POOL
+#=================================================
+
+LXC_POOL_FILL() {
+    # Launch containers from the base image in advance, until there are $BATCH_POOL_SIZE of them
+    # ready in the pool, so that the next apps of the batch don't wait for that (cf run_batch)
+    local pool_dir=$1
+    local image
+    local base_fingerprint
+    _LXC_FIND_BASE_IMAGE
+
+    while [ "$(find "$pool_dir" -name "$LXC_POOL_PREFIX-*" | wc -l)" -lt "$BATCH_POOL_SIZE" ]; do
+        local container="$LXC_POOL_PREFIX-${EPOCHREALTIME//[^0-9]/}"
+        log_debug "Launching $container in advance ..."
+        if _LXC_LAUNCH "$image" "$container" && _LXC_START_AND_WAIT "$container"; then
+            echo "$base_fingerprint" > "$pool_dir/.launched-$container"
+            mv "$pool_dir/.launched-$container" "$pool_dir/$container"
+        else
+            LXC_NAME="$container" LXC_RESET
+            return 1
+        fi
+    done
+}
+
+LXC_POOL_TAKE() {
+    # Prints the name of a container of the pool, if one is ready, and removes it from the pool
+    local pool_dir=$1
+    local ready
+    # (The oldest first, cf their names)
+    for ready in "$pool_dir/$LXC_POOL_PREFIX"-*; do
+        [[ -e "$ready" ]] || continue
+        local container=$(basename "$ready")
+        mv "$ready" "$pool_dir/.taken-$container" 2>/dev/null || continue
+        echo "$container $(cat "$pool_dir/.taken-$container")"
+        rm -f "$pool_dir/.taken-$container"
+        return 0
+    done
+    return 1
+}
+
+LXC_POOL_RESET() {
+    local container
+    for container in $($lxc list --format json | jq -r --arg prefix "$LXC_POOL_PREFIX-" '.[] | select(.name | startswith($prefix)) | .name')
+    do
+        LXC_NAME="$container" LXC_RESET
+    done
+}
+
+#=================================================
+# SNAPSHOT CACHE
+#=================================================
+
+_SNAPSHOT_CACHE_ALIAS() {
+    # The cache is content-addressed: the key is a hash of everything that ends up in the initial snapshot
+    # (including the code of package_check which sets it up, cf _STUFF_TO_RUN_BEFORE_INITIAL_SNAPSHOT)
+    local base_fingerprint=$1
+    local setup_hash=$(cat ./lib/lxc.sh ./lib/tests.sh ./lib/apt_cache_hook.sh | sha256sum | cut -d' ' -f1)
+    echo "ynh-appci-cache-$(echo "$base_fingerprint $setup_hash $(_APT_DEPS_TO_PREINSTALL)" | sha256sum | cut -c1-32)"
+}
+
+_SNAPSHOT_CACHE_LOOKUP() {
+    local alias=$1
+    local max_age_in_sec=$((SNAPSHOT_CACHE_MAX_AGE * 24 * 3600))
+    # Entries older than SNAPSHOT_CACHE_MAX_AGE are ignored such that we don't test with outdated packages forever
+    $lxc image list "$alias" --format json \
+        | jq -e --arg alias "$alias" --argjson max_age "$max_age_in_sec" \
+            '.[] | select(any(.aliases[]; .name==$alias)) | select((.created_at[0:19] + "Z" | fromdateiso8601) > now - $max_age)' \
+            >/dev/null
+}
+
+_SNAPSHOT_CACHE_STORE() {
+    local alias=$1
+
+    log_info "Publishing the initial snapshot as $alias for the next runs ..."
+    start_timer
+    # (Another worker may be publishing the same entry at the same time, in which case this fails harmlessly)
+    $lxc image delete "$alias" 2>/dev/null
+    $lxc publish "$LXC_NAME/snap0" --alias "$alias" --compression none >>/proc/self/fd/3 2>&1 \
+        || log_warning "Failed to publish the initial snapshot in the cache"
+    stop_timer
+
+    _SNAPSHOT_CACHE_EVICT
+}
+
+_SNAPSHOT_CACHE_EVICT() {
+    # Least recently used entries go first, once the cache exceeds SNAPSHOT_CACHE_MAX_SIZE
+    local max_size=$((SNAPSHOT_CACHE_MAX_SIZE * 1024 * 1024 * 1024))
+    local max_age_in_sec=$((SNAPSHOT_CACHE_MAX_AGE * 24 * 3600))
+    local fingerprint
+    for fingerprint in $($lxc image list --format json \
+        | jq -r --argjson max_size "$max_size" --argjson max_age "$max_age_in_sec" \
+            '[.[] | select(any(.aliases[]; .name | startswith("ynh-appci-cache-")))
+                  | {fingerprint, size, used: ([.last_used_at, .created_at] | max), created: (.created_at[0:19] + "Z" | fromdateiso8601)}]
+             | sort_by(.used) | reverse
+             | foreach .[] as $img (0; . + $img.size; if . > $max_size or $img.created < now - $max_age then $img.fingerprint else empty end)')
+    do
+        log_debug "Evicting $fingerprint from the snapshot cache"
+        $lxc image delete "$fingerprint" 2>/dev/null
+    done
+}
+
+_SNAPSHOT_CACHE_REPORT() {
+    local alias=$1
+    local status=$([[ "$SNAPSHOT_CACHE_HIT" == "true" ]] && echo hit || echo miss)
+
+    # shellcheck disable=SC2154
+    echo "$(date +%s) $alias $status" >> "$snapshot_cache_stats"
+
+    local stats=$(tail -n 100 "$snapshot_cache_stats" | awk '{n[$3]++} END {printf "%d hits, %d misses", n["hit"], n["miss"]}')
+    local cache_size=$($lxc image list --format json | jq '[.[] | select(any(.aliases[]; .name | startswith("ynh-appci-cache-"))) | .size] | add // 0 | . / 1024 / 1024 / 1024 * 10 | round / 10')
+    log_info "Snapshot cache $status for $alias ($stats over the last 100 runs, cache size: ${cache_size}GB / ${SNAPSHOT_CACHE_MAX_SIZE}GB)"
+}
+
+#=================================================
+# APT CACHE
+#=================================================
+
+_APT_CACHE_SETUP() {
+    # Share the packages downloaded by apt with the other containers of the host (cf lib/apt_cache_hook.sh)
+    [[ "$APT_CACHE" == "true" ]] || return 0
+
+    if ! LXC_ATTACH_DIR apt_cache "$APT_CACHE_DIR" /var/cache/apt/shared; then
+        log_warning "Failed to mount the apt cache $APT_CACHE_DIR in the container"
+        return 0
+    fi
+    $lxc file push ./lib/apt_cache_hook.sh "$LXC_NAME/usr/local/bin/package_check_apt_cache" --mode 755 >/dev/null
+    $lxc exec "$LXC_NAME" -- /bin/bash -c 'cat > /etc/apt/apt.conf.d/99package-check-apt-cache && package_check_apt_cache seed' <<EOF
+APT::Update::Post-Invoke-Success { "package_check_apt_cache seed"; };
+DPkg::Pre-Install-Pkgs { "package_check_apt_cache record"; };
+DPkg::Post-Invoke { "package_check_apt_cache seed"; };
+EOF
+    apt_cache_since=$(date +%s)
+}
+
+_APT_CACHE_EVICT() {
+    # Least recently used packages go first, once the cache exceeds APT_CACHE_MAX_SIZE
+    # (except the ones used in the last hour, which may be about to be installed somewhere)
+    local max_size=$((APT_CACHE_MAX_SIZE * 1024 * 1024 * 1024))
+    find "$APT_CACHE_DIR" -maxdepth 1 -name "*.deb" -printf "%T@ %s %p\n" \
+        | sort -rn \
+        | awk -v max_size="$max_size" -v recent="$(( $(date +%s) - 3600 ))" '{ total += $2 } total > max_size && $1 < recent { print $3 }' \
+        | xargs -r rm -f
+    find "$APT_CACHE_DIR/.stats" -type f -mtime +7 -delete 2>/dev/null
+}
+
+APT_CACHE_REPORT() {
+    [[ "$APT_CACHE" == "true" ]] && [[ -n "${apt_cache_since:-}" ]] || return 0
+
+    # (The stats of the container and its clones since it was set up, cf the 'record' hook)
+    local stats=$(cat "$APT_CACHE_DIR/.stats/$LXC_NAME" "$APT_CACHE_DIR/.stats/$LXC_NAME"-* 2>/dev/null \
+        | awk -v since="$apt_cache_since" '$1 >= since { n[$2]++; size[$2] += $3 }
+            END { printf "%d hits, %d misses, %dMB downloaded, %dMB saved", n["hit"], n["miss"], size["miss"] / 1048576, size["hit"] / 1048576 }')
+    _APT_CACHE_EVICT
+    local cache_size=$(du -sm "$APT_CACHE_DIR" 2>/dev/null | cut -f1)
+    log_info "Apt cache: $stats (cache size: ${cache_size:-0}MB / ${APT_CACHE_MAX_SIZE}GB)"
+}
+
+LXC_BASE_FINGERPRINT () {
+    # Fingerprint of the base image that LXC_CREATE will launch the container from
+    local fingerprint=""
+    if $lxc remote list 2>/dev/null | grep -q "yunohost"; then
+        fingerprint="$($lxc image list "yunohost:$LXC_BASE" --format json 2>/dev/null | jq -r '.[].fingerprint' | head -n 1)"
+    fi
+    if [[ -z "$fingerprint" ]]; then
+        fingerprint="$($lxc image list "$LXC_BASE" --format json 2>/dev/null | jq -r --arg LXC_BASE "$LXC_BASE" '.[] | select(any(.aliases[]; .name==$LXC_BASE)) | .fingerprint')"
+    fi
+    echo "$fingerprint"
 }
 
 LXC_SNAPSHOT_EXISTS() {
@@ -127,6 +346,7 @@ LOAD_LXC_SNAPSHOT () {
     # Remove swap files before restoring the snapshot.
     CLEAN_SWAPFILES
 
+    _LXC_FORGET_READY "$LXC_NAME"
     local retry_lxc=0
     while [[ ${retry_lxc} -lt 10 ]]
     do
@@ -149,6 +369,9 @@ LOAD_LXC_SNAPSHOT () {
         log_error "Failed to restore snapshot ? The next step may miserably crash because of this ... if this happens to often, maybe restarting the LXD daemon can help ..."
     fi
 
+    # The copy of the app in the container rolled back too
+    _APP_FOLDER_SYNC_FORGET
+
     $lxc start "$LXC_NAME"
     _LXC_START_AND_WAIT "$LXC_NAME"
 }
@@ -157,20 +380,27 @@ LOAD_LXC_SNAPSHOT () {
 
 LXC_EXEC () {
     # Start the lxc container and execute the given command in it
+    # (with filter_debug as second arg, the DEBUG lines are only logged, not displayed)
     local cmd=$1
+    local filter_debug=${2:-}
 
     _LXC_START_AND_WAIT "$LXC_NAME"
 
     start_timer
 
     # Execute the command given in argument in the container and log its results.
-    logfiles=("${full_log:-}")
+    # The output is analyzed on the fly (warnings, errors, ...) into the digest of the current test
+    local analyzer_args=("${full_log:-}")
     if [[ -n "${current_test_log:-}" ]]; then
-        logfiles+=("$current_test_log")
+        # shellcheck disable=SC2154
+        analyzer_args+=("$current_test_log" --digest "$current_test_tmp/log_digest.json")
+    fi
+    if [[ "$filter_debug" == "filter_debug" ]]; then
+        analyzer_args+=(--filter-debug)
     fi
 
     : "${current_test_log:=}"
-    $lxc exec "$LXC_NAME" --env PACKAGE_CHECK_EXEC=1 -t -- /bin/bash -c "$cmd" | tee -a "${logfiles[@]}"
+    $lxc exec "$LXC_NAME" --env PACKAGE_CHECK_EXEC=1 -t -- /bin/bash -c "$cmd" | python3 lib/log_analyzer.py "${analyzer_args[@]}"
 
     # Store the return code of the command
     local returncode=${PIPESTATUS[0]}
@@ -184,6 +414,7 @@ LXC_EXEC () {
 
 LXC_STOP () {
     local container_to_stop=$1
+    _LXC_FORGET_READY "$container_to_stop"
     # (We also use timeout 30 in front of the command because sometime lxc
     # commands can hang forever despite the --timeout >_>...)
     timeout 30 "$lxc" stop --timeout 15 "$container_to_stop" 2>/dev/null
@@ -224,77 +455,172 @@ LXC_RESET () {
     fi
 
     $lxc delete "$LXC_NAME" --force 2>/dev/null
+    _LXC_FORGET_READY "$LXC_NAME"
+    _APP_FOLDER_SYNC_FORGET
+}
+
+_APP_FOLDER_SYNC_STATE() {
+    # cf lib/app_folder_sync.py
+    echo "$TEST_CONTEXT/tmp/app_folder_sync/$LXC_NAME"
+}
+
+_APP_FOLDER_SYNC_FORGET() {
+    # The next sync will have to compare with what's actually in the container
+    [[ -n "${TEST_CONTEXT:-}" ]] || return 0
+    rm -f "$(_APP_FOLDER_SYNC_STATE)/synced"
+}
+
+LXC_CLONE () {
+    # Create another container from the initial snapshot of $LXC_NAME (to run tests in parallel)
+    local clone=$1
+
+    log_debug "Cloning $LXC_NAME/snap0 into $clone ..."
+    LXC_NAME="$clone" LXC_RESET
+    $lxc copy "$LXC_NAME/snap0" "$clone" >>/proc/self/fd/3 \
+        || log_critical "Failed to clone $LXC_NAME into $clone :/"
+
+    if [[ "$lxc" == "lxc" ]]; then
+        $lxc snapshot "$clone" snap0
+    else
+        $lxc snapshot create "$clone" snap0
+    fi
+}
+
+LXC_RESET_CLONES () {
+    local clone
+    for clone in $($lxc list --format json | jq -r --arg LXC_NAME "$LXC_NAME" '.[] | select(.name | startswith($LXC_NAME + "-")) | .name')
+    do
+        LXC_NAME="$clone" LXC_RESET
+    done
+}
+
+LXC_ATTACH_DIR () {
+    # Bind-mount a directory of the host in the container, as a disk device named $1
+    # (the devices are part of the snapshots: restoring one that was taken without it detaches it)
+    local device=$1
+    local source=$2
+    local path=$3
+
+    LXC_DETACH_DIR "$device"
+    mkdir -p "$source"
+    $lxc config device add "$LXC_NAME" "$device" disk source="$source" path="$path" >>/proc/self/fd/3 2>&1
+}
+
+LXC_DETACH_DIR () {
+    local device=$1
+    $lxc config device remove "$LXC_NAME" "$device" >/dev/null 2>&1 || true
 }
 
 
 _LXC_START_AND_WAIT() {
+    local container=$1
+    local ready_file=$(_LXC_READY_FILE "$container")
+
+    # Nothing to wait for if it didn't stop since it was ready (cf LXC_STOP), i.e. if its init
+    # is still the same process (it changes when it gets restarted in any other way, e.g. by a reboot)
+    if [[ -e "$ready_file" ]]; then
+        local ready_ip ready_pid
+        read -r ready_ip ready_pid < "$ready_file"
+        if [[ -n "$ready_pid" ]] && [[ "$(_LXC_STATE "$container" | jq -r '.pid')" == "$ready_pid" ]]; then
+            LXC_IP=$ready_ip
+            return 0
+        fi
+        _LXC_FORGET_READY "$container"
+    fi
+
+    # Try to start the container 3 times.
+    local _
+    for _ in 1 2 3; do
+        if _LXC_WAIT_UNTIL_READY "$container"; then
+            if [[ -n "$ready_file" ]]; then
+                mkdir -p "$(dirname "$ready_file")"
+                echo "$LXC_IP $(_LXC_STATE "$container" | jq -r '.pid')" > "$ready_file"
+            fi
+            return 0
+        fi
+        log_debug "The container isn't ready ($readiness_failure) ... restarting ..."
+        LXC_STOP "$container"
+    done
+
+    log_error "The container miserably failed to start or to connect to the internet ($readiness_failure)"
+    $lxc info --show-log "$container"
+    return 1
+}
+
+_LXC_READY_FILE() {
+    # (Shared by all the workers, which run in subshells)
+    [[ -z "${TEST_CONTEXT:-}" ]] || echo "$TEST_CONTEXT/tmp/lxc_ready/$1"
+}
+
+_LXC_FORGET_READY() {
+    local ready_file=$(_LXC_READY_FILE "$1")
+    [[ -z "$ready_file" ]] || rm -f "$ready_file"
+}
+
+_LXC_STATE() {
+    local container=$1
+    $lxc list "$container" --format json | jq --arg container "$container" '.[] | select(.name==$container) | .state'
+}
+
+_LXC_WAIT_UNTIL_READY() {
+    # Block until each step is actually done, rather than polling or sleeping for a fixed time
+    local container=$1
+    local deadline=$((SECONDS + READINESS_TIMEOUT))
+    local started_at=$EPOCHREALTIME
+    readiness_failure=""
+
+    if [[ "$(_LXC_STATE "$container" | jq -r '.status')" != "Running" ]]; then
+        $lxc start "$container" 2>/dev/null
+    fi
+    local running_at=$EPOCHREALTIME
+
+    # --wait blocks until the boot is over (but systemd may not even answer right after the start)
+    local system_state=""
+    while true; do
+        system_state=$($lxc exec "$container" -- timeout "$((deadline > SECONDS ? deadline - SECONDS : 1))" systemctl is-system-running --wait 2>/dev/null)
+        [[ "$system_state" == "running" ]] || [[ "$system_state" == "degraded" ]] && break
+        if [ $SECONDS -ge $deadline ]; then
+            readiness_failure="system ${system_state:-unreachable}"
+            return 1
+        fi
+        sleep 0.5
+    done
+    local booted_at=$EPOCHREALTIME
+
+    LXC_IP=""
+    while [[ -z "$LXC_IP" ]]; do
+        LXC_IP=$(_LXC_STATE "$container" | jq -r '[.network // {} | to_entries[] | select(.key != "lo") | .value.addresses[] | select(.family=="inet" and .scope=="global") | .address][0] // empty')
+        [[ -n "$LXC_IP" ]] && break
+        if [ $SECONDS -ge $deadline ]; then
+            readiness_failure="no IP address"
+            return 1
+        fi
+        sleep 0.5
+    done
+    local ip_at=$EPOCHREALTIME
+
+    if [[ -n "$READINESS_PROBE_URL" ]]; then
+        if ! $lxc exec "$container" -- curl -s -o /dev/null --max-time 10 --retry 100 --retry-delay 1 --retry-all-errors \
+            --retry-max-time "$((deadline > SECONDS ? deadline - SECONDS : 1))" "$READINESS_PROBE_URL" 2>/dev/null; then
+            readiness_failure="can't reach $READINESS_PROBE_URL"
+            return 1
+        fi
+    fi
+    local online_at=$EPOCHREALTIME
+
+    local latencies=$(jq -nc --arg container "$container" \
+        --argjson t0 "$started_at" --argjson t1 "$running_at" --argjson t2 "$booted_at" --argjson t3 "$ip_at" --argjson t4 "$online_at" \
+        '{$container, time: ($t0 | floor), start: ($t1 - $t0), boot: ($t2 - $t1), ip: ($t3 - $t2), network: ($t4 - $t3), total: ($t4 - $t0)}
+         | map_values(if type == "number" and . < 1e9 then . * 100 | round / 100 else . end)')
+    log_debug "Container ready: $latencies"
+    [[ -z "${TEST_CONTEXT:-}" ]] || echo "$latencies" >> "$TEST_CONTEXT/lxc_readiness.jsonl"
+}
 
-    restart_container()
-	{
-        LXC_STOP "$1"
-		$lxc start "$1"
-	}
-
-	# Try to start the container 3 times.
-	local max_try=3
-	local i=0
-	while [ $i -lt $max_try ]
-	do
-		i=$(( i +1 ))
-		local failstart=0
-
-		# Wait for container to start, we are using systemd to check this,
-		# for the sake of brevity.
-		for j in $(seq 1 10); do
-			if $lxc exec "$1" -- timeout 30 systemctl isolate multi-user.target >/dev/null 2>/dev/null; then
-				break
-			fi
-
-			if [ "$j" == "10" ]; then
-				log_debug 'Failed to start the container ... restarting ...'
-				failstart=1
-
-				restart_container "$1"
-			fi
-
-			sleep 1s
-		done
-
-		# Wait for container to access the internet
-		for j in $(seq 1 10); do
-			if $lxc exec "$1" -- timeout 10 curl -s http://wikipedia.org > /dev/null 2>/dev/null; then
-				break
-			fi
-
-			if [ "$j" == "10" ]; then
-				log_debug 'Failed to access the internet ... restarting'
-				failstart=1
-
-				restart_container "$1"
-			fi
-
-			sleep 1s
-		done
-
-		# Has started and has access to the internet
-		if [ $failstart -eq 0 ]
-		then
-			break
-		fi
-
-		# Fail if the container failed to start
-		if [ $i -eq $max_try ] && [ $failstart -eq 1 ]
-		then
-            log_error "The container miserably failed to start or to connect to the internet"
-            $lxc info --show-log "$1"
-			return 1
-		fi
-	done
-
-    sleep 3
-
-    # shellcheck disable=SC2034
-    LXC_IP=$($lxc exec "$1" -- hostname -I | cut -d' ' -f1 | grep -E -o "\<[0-9.]{8,}\>")
+LXC_READINESS_REPORT() {
+    local latencies="$TEST_CONTEXT/lxc_readiness.jsonl"
+    [[ -e "$latencies" ]] || return 0
+    log_info "$(jq -rs 'def mean(f): map(f) | add / length * 10 | round / 10;
+        "The containers got ready \(length) times, in \(mean(.total))s on average (start: \(mean(.start))s, boot: \(mean(.boot))s, IP: \(mean(.ip))s, network: \(mean(.network))s), \(map(.total) | max)s at most"' "$latencies")"
 }
 
 CLEAN_SWAPFILES() {
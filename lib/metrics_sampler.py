@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# Samples the resources used by a container, from the host, by reading its
+# cgroup v2 files a few times per second (no process spawned, nothing ran in
+# the container), until it gets a SIGTERM. Each sample is appended to a time
+# series, and a summary is printed on exit:
+#
+#   metrics_sampler.py <container> --output metrics.jsonl > summary.json &
+#   ...
+#   kill $!
+#
+# On hosts without cgroup v2, only the RAM is sampled, with 'free' in the container.
+
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+INTERVAL = float(os.environ.get("METRICS_INTERVAL", 0.25))
+# Stop sampling (and print the summary) on these
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+FIELDS = ["time", "ram_mb", "cpu_percent", "io_read_kb", "io_write_kb", "pids"]
+
+MB = 1024 * 1024
+
+
+def find_cgroup(container, lxc):
+    # That's where both LXD and Incus put the containers
+    path = os.path.join(CGROUP_ROOT, f"lxc.payload.{container}")
+    if os.path.exists(os.path.join(path, "memory.current")):
+        return path
+
+    # Otherwise, look for it from the pid of the container's init
+    info = subprocess.run([lxc, "info", container], capture_output=True, text=True)
+    pid = re.search(r"^PID: *([0-9]+)", info.stdout, re.MULTILINE)
+    if not pid:
+        return None
+    try:
+        cgroup = open(f"/proc/{pid.group(1)}/cgroup").read()
+    except OSError:
+        return None
+    match = re.search(r"^0::(/.*)$", cgroup, re.MULTILINE)
+    if not match:
+        return None
+    path = CGROUP_ROOT + match.group(1)
+    while path != CGROUP_ROOT and not os.path.basename(path).startswith("lxc.payload."):
+        path = os.path.dirname(path)
+    return path if os.path.exists(os.path.join(path, "memory.current")) else None
+
+
+def read_keys(path):
+    with open(path) as f:
+        return dict(line.split()[:2] for line in f if line.strip())
+
+
+class CgroupReader:
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return f.read()
+
+    def sample(self):
+        # The "working set", like 'free' inside the container: without the page cache that can be reclaimed
+        memory_stat = read_keys(os.path.join(self.path, "memory.stat"))
+        ram = int(self.read("memory.current")) - int(
+            memory_stat.get("inactive_file", 0)
+        )
+
+        io_read = io_write = 0
+        for line in self.read("io.stat").splitlines():
+            stats = dict(f.split("=") for f in line.split()[1:] if "=" in f)
+            io_read += int(stats.get("rbytes", 0))
+            io_write += int(stats.get("wbytes", 0))
+
+        return {
+            "ram": ram,
+            "cpu_usec": int(
+                read_keys(os.path.join(self.path, "cpu.stat"))["usage_usec"]
+            ),
+            "io_read": io_read,
+            "io_write": io_write,
+            "pids": int(self.read("pids.current")),
+        }
+
+    def memory_peak(self):
+        try:
+            return int(self.read("memory.peak"))
+        except (OSError, ValueError):
+            return None
+
+
+class FreeReader:
+    """
+    For hosts without cgroup v2
+    """
+
+    def __init__(self, container, lxc):
+        self.container = container
+        self.lxc = lxc
+
+    def sample(self):
+        free = subprocess.run(
+            [self.lxc, "exec", self.container, "--", "free", "-b"],
+            capture_output=True,
+            text=True,
+        )
+        used = re.search(r"^Mem: +[0-9]+ +([0-9]+)", free.stdout, re.MULTILINE)
+        return {
+            "ram": int(used.group(1)) if used else 0,
+            "cpu_usec": None,
+            "io_read": None,
+            "io_write": None,
+            "pids": None,
+        }
+
+    def memory_peak(self):
+        return None
+
+
+def increase(previous, current):
+    # (The counters restart from 0 if the container is restarted during the test)
+    if current is None:
+        return None
+    return current - previous if current >= previous else current
+
+
+def sample_until_stopped(reader, output, interval):
+    # The signals are only handled between two samples, cf sigtimedwait below
+    start = time.monotonic()
+    first = None
+    while first is None:
+        try:
+            first = reader.sample()
+        except OSError:
+            # The container is being restarted
+            if signal.sigtimedwait(STOP_SIGNALS, interval):
+                return None
+    previous, previous_time = first, time.monotonic()
+    peak_at_start = reader.memory_peak()
+
+    rams = [first["ram"]]
+    cpu_percents = []
+    io_read = io_write = 0
+    peak_pids = first["pids"]
+
+    output.write(
+        json.dumps({"start": int(time.time()), "fields": FIELDS, "every": interval})
+        + "\n"
+    )
+
+    while not signal.sigtimedwait(STOP_SIGNALS, interval):
+        now = time.monotonic()
+        try:
+            current = reader.sample()
+        except OSError:
+            # The container is being restarted
+            continue
+
+        cpu_percent = None
+        if current["cpu_usec"] is not None:
+            cpu_usec = increase(previous["cpu_usec"], current["cpu_usec"])
+            cpu_percent = round(cpu_usec / 1e4 / (now - previous_time), 1)
+            cpu_percents.append(cpu_percent)
+            io_read += increase(previous["io_read"], current["io_read"])
+            io_write += increase(previous["io_write"], current["io_write"])
+            peak_pids = max(peak_pids, current["pids"])
+        rams.append(current["ram"])
+
+        sample = [round(now - start, 2), round(current["ram"] / MB, 1), cpu_percent]
+        if current["cpu_usec"] is not None:
+            sample += [io_read // 1024, io_write // 1024, current["pids"]]
+        output.write(json.dumps(sample) + "\n")
+        output.flush()
+
+        previous, previous_time = current, now
+
+    peak_ram = max(rams)
+    # memory.peak also counts the page cache, but if it grew during the test,
+    # it caught a spike that happened between two samples
+    peak_at_end = reader.memory_peak()
+    spike = (
+        peak_at_end
+        if peak_at_start is not None and peak_at_end and peak_at_end > peak_at_start
+        else None
+    )
+    has_cgroup_stats = first["cpu_usec"] is not None
+
+    return {
+        "duration": round(time.monotonic() - start, 1),
+        "samples": len(rams),
+        "ram_base_mb": round(first["ram"] / MB),
+        "ram_end_mb": round(rams[-1] / MB),
+        "ram_mean_mb": round(sum(rams) / len(rams) / MB),
+        "ram_peak_mb": round(peak_ram / MB),
+        "peak_ram_usage": round((peak_ram - first["ram"]) / MB),
+        "memory_peak_with_cache_mb": round(spike / MB) if spike else None,
+        "cpu_mean_percent": (
+            round(sum(cpu_percents) / len(cpu_percents), 1) if cpu_percents else None
+        ),
+        "cpu_peak_percent": max(cpu_percents) if cpu_percents else None,
+        "io_read_mb": round(io_read / MB, 1) if has_cgroup_stats else None,
+        "io_write_mb": round(io_write / MB, 1) if has_cgroup_stats else None,
+        "pids_peak": peak_pids,
+    }
+
+
+def main():
+    # (Right away: the test may be over before the sampling even starts, cf metrics_stop)
+    signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("container")
+    parser.add_argument("--output", required=True, help="Time series (appended)")
+    parser.add_argument("--lxc", default="lxc", help="lxc or incus")
+    parser.add_argument("--interval", type=float, default=INTERVAL)
+    args = parser.parse_args()
+
+    cgroup = find_cgroup(args.container, args.lxc)
+    if cgroup:
+        reader = CgroupReader(cgroup)
+        interval = args.interval
+    else:
+        print(
+            "No cgroup v2 found for the container, only sampling its RAM with 'free'",
+            file=sys.stderr,
+        )
+        reader = FreeReader(args.container, args.lxc)
+        interval = max(args.interval, 1)
+
+    with open(args.output, "a") as output:
+        summary = sample_until_stopped(reader, output, interval)
+
+    if summary is None:
+        print("Stopped before the container could be sampled at all", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
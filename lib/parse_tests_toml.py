@@ -3,8 +3,9 @@
 from typing import Any
 import argparse
 import copy
+import hashlib
 import json
-import os
+import re
 import sys
 from pathlib import Path
 
@@ -110,21 +111,129 @@ def filter_test_list(test_manifest, base_test_list):
         yield test_suite_id, tests_for_this_suite
 
 
-def dump_for_package_check(
-    test_list: dict[str, dict[str, Any]], package_check_tests_dir: Path
-) -> None:
-    test_suite_i = 0
+# Those need at least one successful install (cf at_least_one_install_succeeded)
+# and are much cheaper once the install snapshot exists
+TESTS_DEPENDING_ON_INSTALL = (
+    "install.multi",
+    "upgrade",
+    "backup_restore",
+    "change_url",
+)
+INSTALL_TESTS = ("install.root", "install.subdir", "install.nourl")
+
+
+def test_file_ids(test_list: dict[str, dict[str, Any]]) -> dict[tuple[str, str], int]:
+    return {
+        (test_suite_id, test): test_suite_i * 100 + subtest_i
+        for test_suite_i, (test_suite_id, subtest_list) in enumerate(
+            test_list.items(), start=1
+        )
+        for subtest_i, test in enumerate(subtest_list, start=1)
+    }
+
 
+def dependency_graph(test_list: dict[str, dict[str, Any]]) -> dict[int, list[int]]:
+    """
+    Map each test file id to the ids of the tests that have to be done before it.
+    Tests needing an install depend on the install tests of their serie, or on
+    the install tests of every serie if theirs doesn't have any.
+    """
+
+    ids = test_file_ids(test_list)
+    all_installs = [id_ for (_, test), id_ in ids.items() if test in INSTALL_TESTS]
+
+    graph = {}
+    for (test_suite_id, test), id_ in ids.items():
+        # (upgrade.<commit> being the upgrades from older commits)
+        if test not in TESTS_DEPENDING_ON_INSTALL and not test.startswith("upgrade."):
+            graph[id_] = []
+            continue
+        installs_of_this_suite = [
+            ids[(test_suite_id, install)]
+            for install in INSTALL_TESTS
+            if (test_suite_id, install) in ids
+        ]
+        graph[id_] = installs_of_this_suite or all_installs
+
+    return graph
+
+
+# Files and folders of the app which may change the result of each type of test
+COMMON_TEST_INPUTS = [
+    "manifest.toml",
+    "config_panel.toml",
+    "conf",
+    "sources",
+    "hooks",
+    "patches",
+    "scripts/_common.sh",
+    "scripts/config",
+]
+TEST_INPUTS = {
+    "package_linter": [""],  # The linter looks at everything
+    "install": ["scripts/install", "scripts/remove"],
+    "upgrade": ["scripts/install", "scripts/upgrade"],
+    "backup_restore": [
+        "scripts/install",
+        "scripts/backup",
+        "scripts/restore",
+        "scripts/remove",
+    ],
+    "change_url": ["scripts/install", "scripts/change_url"],
+}
+
+
+def input_files(basedir: Path, paths: list[str]):
+    for path in paths:
+        path = basedir / path
+        if path.is_file():
+            yield path
+        elif path.is_dir():
+            yield from sorted(
+                f for f in path.rglob("*") if f.is_file() and ".git" not in f.parts
+            )
+
+
+def test_fingerprints(
+    basedir: Path, test_list: dict[str, dict[str, Any]], base_image: str
+) -> dict[tuple[str, str], str]:
+    """
+    Hash of everything a test depends on: the app files it runs, its test serie
+    in tests.toml, and the base image. Upgrades from older commits have the
+    commit in their test id.
+    """
+
+    test_manifest = toml.load((basedir / "tests.toml").open("r"))
+
+    fingerprints = {}
     for test_suite_id, subtest_list in test_list.items():
-        test_suite_i += 1
+        serie = json.dumps(test_manifest[test_suite_id], sort_keys=True, default=str)
+        for test in subtest_list:
+            h = hashlib.sha256()
+            for data in [test_suite_id, test, serie, base_image]:
+                h.update(data.encode() + b"\0")
+            paths = COMMON_TEST_INPUTS + TEST_INPUTS.get(test.split(".")[0], [""])
+            for file in sorted(set(input_files(basedir, paths))):
+                h.update(str(file.relative_to(basedir)).encode() + b"\0")
+                h.update(file.read_bytes())
+            fingerprints[(test_suite_id, test)] = h.hexdigest()
+
+    return fingerprints
+
 
-        subtest_i = 0
+def dump_for_package_check(
+    test_list: dict[str, dict[str, Any]],
+    package_check_tests_dir: Path,
+    fingerprints: dict[tuple[str, str], str] | None = None,
+) -> None:
+    fingerprints = fingerprints or {}
+    ids = test_file_ids(test_list)
+    graph = dependency_graph(test_list)
 
+    for test_suite_id, subtest_list in test_list.items():
         for test, meta in subtest_list.items():
             meta = copy.copy(meta)
 
-            subtest_i += 1
-
             if "." in test:
                 test_type, test_arg = test.split(".")
             else:
@@ -141,33 +250,39 @@ def dump_for_package_check(
                     [k + "=" + str(v) for k, v in meta.pop("install_args").items()]
                 ),
                 "extra": meta,  # Boring legacy logic just to ship the upgrade-from-commit's name ...
+                "depends_on": graph[ids[(test_suite_id, test)]],
+                "fingerprint": fingerprints.get((test_suite_id, test)),
             }
 
-            test_file_id = test_suite_i * 100 + subtest_i
+            test_file_id = ids[(test_suite_id, test)]
 
             json.dump(J, (package_check_tests_dir / f"{test_file_id}.json").open("w"))
 
 
-def build_test_list(basedir: Path) -> dict[str, dict[str, Any]]:
-    test_manifest = toml.load((basedir / "tests.toml").open("r"))
-
-    manifest = toml.load((basedir / "manifest.toml").open("r"))
-    is_multi_instance = manifest.get("integration").get("multi_instance") is True
-
-    is_webapp = (
-        os.system(
-            f"grep -q '^ynh_add_nginx_config\\|^ynh_nginx_add_config\\|^ynh_config_add_nginx' '{str(basedir)}/scripts/install'"
+def is_webapp(basedir: Path) -> bool:
+    install_script = (basedir / "scripts" / "install").read_text(errors="replace")
+    return (
+        re.search(
+            r"^(ynh_add_nginx_config|ynh_nginx_add_config|ynh_config_add_nginx)",
+            install_script,
+            re.MULTILINE,
         )
-        == 0
+        is not None
     )
 
+
+def build_test_list(
+    basedir: Path, manifest: dict, test_manifest: dict
+) -> dict[str, dict[str, Any]]:
+    is_multi_instance = manifest.get("integration").get("multi_instance") is True
+
     default_install_args = get_default_values_for_questions(
         manifest, raise_if_no_default=False
     )
 
     base_test_list = list(
         generate_test_list_base(
-            test_manifest, default_install_args, is_webapp, is_multi_instance
+            test_manifest, default_install_args, is_webapp(basedir), is_multi_instance
         )
     )
     test_list = dict(filter_test_list(test_manifest, base_test_list))
@@ -175,6 +290,65 @@ def build_test_list(basedir: Path) -> dict[str, dict[str, Any]]:
     return test_list
 
 
+def apt_deps_to_preinstall(manifest: dict) -> tuple[str, list[str]]:
+    """
+    The apt dependencies of the app, and the php versions they use
+    """
+    app_id = manifest["id"]
+    packages = manifest.get("resources", {}).get("apt", {}).get("packages", "")
+    if isinstance(packages, str):
+        packages = packages.replace(",", " ").split()
+    # We filter apt deps starting with the app id to prevent stupid issues with for example cockpit and transmission where the apt package is not properly reinstalled on reinstall-after-remove test ...
+    packages = [p for p in packages if p != app_id and not p.startswith(app_id + "-")]
+
+    # This bit is copypasta of the apt helpers
+    php_versions = sorted(set(re.findall(r"(?<=php)[0-9.]+", " ".join(packages))))
+    if len(php_versions) == 1:
+        v = php_versions[0]
+        packages += [f"php{v}", f"php{v}-fpm", f"php{v}-common"]
+
+    return " ".join(packages), php_versions
+
+
+def compile_test_plan(
+    basedir: Path,
+    manifest: dict,
+    test_manifest: dict,
+    test_list: dict[str, dict[str, Any]],
+) -> dict[str, Any]:
+    """
+    Everything package_check needs to know about the app (in its current
+    version), so that it doesn't have to parse the manifests again and again
+    """
+    apt_deps, php_versions = apt_deps_to_preinstall(manifest)
+    return {
+        "app_id": manifest["id"],
+        "version": manifest.get("version", ""),
+        "is_webapp": is_webapp(basedir),
+        "is_multi_instance": manifest.get("integration", {}).get("multi_instance")
+        is True,
+        "apt_deps": apt_deps,
+        "php_versions": php_versions,
+        "install_args": list(manifest.get("install", {})),
+        "install_args_defaults": {
+            name: str(question["default"]) if "default" in question else None
+            for name, question in manifest.get("install", {}).items()
+        },
+        "install_types": sorted(
+            test.split(".")[1]
+            for tests in test_list.values()
+            for test in tests
+            if test.startswith("install.")
+        ),
+        "curl_tests": {
+            test_suite_id: toml.dumps(
+                test_manifest[test_suite_id].get("curl_tests", {})
+            )
+            for test_suite_id in test_list
+        },
+    }
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("app", type=Path, help="Path to the app directory")
@@ -185,13 +359,35 @@ def main() -> None:
         required=False,
         help="Dump the result to the package check directory",
     )
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        required=False,
+        help="Write the compiled test plan (app id, version, apt deps, default install args, curl tests...) to this file",
+    )
+    parser.add_argument(
+        "--base-image",
+        required=False,
+        help="Fingerprint of the base image, to compute the fingerprint of each test (used to reuse results from previous runs)",
+    )
     args = parser.parse_args()
 
-    test_list = build_test_list(args.app)
+    manifest = toml.load((args.app / "manifest.toml").open("r"))
+    test_manifest = toml.load((args.app / "tests.toml").open("r"))
+    test_list = build_test_list(args.app, manifest, test_manifest)
+
+    if args.plan:
+        plan = compile_test_plan(args.app, manifest, test_manifest, test_list)
+        json.dump(plan, args.plan.open("w"), indent=4)
 
     if args.dump_to:
-        dump_for_package_check(test_list, args.dump_to)
-    else:
+        fingerprints = (
+            test_fingerprints(args.app, test_list, args.base_image)
+            if args.base_image
+            else {}
+        )
+        dump_for_package_check(test_list, args.dump_to, fingerprints)
+    elif not args.plan:
         print(json.dumps(test_list, indent=4))
 
 
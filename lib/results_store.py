@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# The results of the tests of a run, in the test context:
+#  - results/<id>.events.jsonl: every change of the results of a test, appended
+#    as they happen (and under a lock, so workers can't step on each other)
+#  - results/<id>.json: the current results of the test, i.e. all its events
+#    folded together (what analyze_test_results.py & co read)
+#  - tests_index.json: the type/arg/serie of every test, so that questions about
+#    all the tests are answered by reading a single file
+#
+#   results_store.py set <test_context> <test_id> <key> <value> [--json] [--max|--append]
+#   results_store.py import <test_context> <test_id> < results.json
+#   results_store.py query <test_context> [--test-type ...] [--main-result ...] [--ids]
+#   results_store.py compact <test_context>
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+TEST_PLAN_KEYS = ["test_type", "test_arg", "test_serie"]
+
+
+def results_file(test_context, test_id):
+    return os.path.join(test_context, "results", f"{test_id}.json")
+
+
+def events_file(test_context, test_id):
+    return os.path.join(test_context, "results", f"{test_id}.events.jsonl")
+
+
+def write_atomically(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def events_of(test_context, test_id):
+    with open(events_file(test_context, test_id), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield f
+
+
+def read_events(f):
+    f.seek(0)
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def apply(results, event):
+    """
+    Fold an event into the results of a test
+    """
+    if event["op"] == "import":
+        return dict(event["value"])
+    if event["op"] == "max" and results.get(event["key"]) is not None:
+        results[event["key"]] = max(results[event["key"]], event["value"])
+    elif event["op"] == "append":
+        results.setdefault(event["key"], []).append(event["value"])
+    else:
+        results[event["key"]] = event["value"]
+    return results
+
+
+def fold(events):
+    results = {}
+    for event in events:
+        results = apply(results, event)
+    return results
+
+
+def record(test_context, test_id, event):
+    event["time"] = time.time()
+    with events_of(test_context, test_id) as f:
+        f.write(json.dumps(event) + "\n")
+        f.flush()
+        path = results_file(test_context, test_id)
+        results = json.load(open(path)) if os.path.exists(path) else {}
+        write_atomically(path, apply(results, event))
+
+
+def set_result(test_context, test_id, key, value, op="set"):
+    record(test_context, test_id, {"op": op, "key": key, "value": value})
+
+
+def import_results(test_context, test_id, results):
+    """
+    Replace all the results of a test (e.g. the linter's, or a cached result)
+    """
+    record(test_context, test_id, {"op": "import", "value": results})
+
+
+def compact(test_context):
+    """
+    Rewrite the results of each test from its events
+    """
+    results_dir = os.path.join(test_context, "results")
+    for name in sorted(os.listdir(results_dir)):
+        if name.endswith(".events.jsonl"):
+            test_id = name[: -len(".events.jsonl")]
+            with events_of(test_context, test_id) as f:
+                write_atomically(
+                    results_file(test_context, test_id), fold(read_events(f))
+                )
+
+
+def tests_index(test_context):
+    """
+    The test plan doesn't change during a run, so it's only read once
+    """
+    tests_dir = os.path.join(test_context, "tests")
+    index_file = os.path.join(test_context, "tests_index.json")
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(
+        tests_dir
+    ):
+        return json.load(open(index_file))
+
+    index = {}
+    for name in sorted(os.listdir(tests_dir)):
+        if name.endswith(".json"):
+            test = json.load(open(os.path.join(tests_dir, name)))
+            index[name[: -len(".json")]] = {k: test.get(k) for k in TEST_PLAN_KEYS}
+    write_atomically(index_file, index)
+    return index
+
+
+def query(test_context, main_result=None, **criteria):
+    """
+    Ids of the tests matching all the criteria. main_result="none" matches the
+    tests which don't have a result yet
+    """
+    for test_id, test in tests_index(test_context).items():
+        if any(
+            value is not None and test[key] != value for key, value in criteria.items()
+        ):
+            continue
+        if main_result is not None:
+            path = results_file(test_context, test_id)
+            results = json.load(open(path)) if os.path.exists(path) else {}
+            if results.get("main_result", "none") != main_result:
+                continue
+        yield test_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    set_parser = subparsers.add_parser("set", help="Set one of the results of a test")
+    set_parser.add_argument("test_context")
+    set_parser.add_argument("test_id")
+    set_parser.add_argument("key")
+    set_parser.add_argument("value")
+    set_parser.add_argument(
+        "--json", action="store_true", help="The value is JSON rather than a string"
+    )
+    set_parser.add_argument(
+        "--max", action="store_true", help="Only keep the highest value"
+    )
+    set_parser.add_argument(
+        "--append", action="store_true", help="Add the value to a list of values"
+    )
+
+    import_parser = subparsers.add_parser(
+        "import", help="Replace the results of a test with the JSON on stdin"
+    )
+    import_parser.add_argument("test_context")
+    import_parser.add_argument("test_id")
+
+    query_parser = subparsers.add_parser(
+        "query", help="Exits with 0 if some tests match all the criteria, 1 otherwise"
+    )
+    query_parser.add_argument("test_context")
+    query_parser.add_argument("--test-type")
+    query_parser.add_argument("--test-arg")
+    query_parser.add_argument("--test-serie")
+    query_parser.add_argument(
+        "--main-result", help="success, failure, ... or none for tests not done yet"
+    )
+    query_parser.add_argument(
+        "--ids", action="store_true", help="Print the ids of the matching tests"
+    )
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="Rewrite the results of every test from its events"
+    )
+    compact_parser.add_argument("test_context")
+
+    args = parser.parse_args()
+
+    if args.action == "set":
+        value = json.loads(args.value) if args.json else args.value
+        set_result(
+            args.test_context,
+            args.test_id,
+            args.key,
+            value,
+            op="max" if args.max else "append" if args.append else "set",
+        )
+    elif args.action == "import":
+        data = sys.stdin.read()
+        try:
+            results = json.loads(data)
+        except json.JSONDecodeError:
+            print(
+                f"Invalid results for test {args.test_id}, ignoring them",
+                file=sys.stderr,
+            )
+            results = {}
+        import_results(args.test_context, args.test_id, results)
+    elif args.action == "query":
+        matches = query(
+            args.test_context,
+            test_type=args.test_type,
+            test_arg=args.test_arg,
+            test_serie=args.test_serie,
+            main_result=args.main_result,
+        )
+        if args.ids:
+            matches = list(matches)
+            print("\n".join(matches))
+            sys.exit(0 if matches else 1)
+        # (No need to look further than the first match)
+        sys.exit(0 if next(matches, None) is not None else 1)
+    elif args.action == "compact":
+        compact(args.test_context)
+
+
+if __name__ == "__main__":
+    main()
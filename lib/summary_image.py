@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Render the summary made by analyze_test_results.py (text with <style=...>
+# markup) as a PNG or SVG image, without any external binary: each glyph is
+# rasterized once and then pasted wherever it's needed on a palette image.
+#
+#   python3 lib/summary_image.py --benchmark   # compare with wkhtmltoimage
+
+import argparse
+import html
+import os
+import re
+import tempfile
+import time
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+FONT_SIZE = 13
+LINE_HEIGHT = 16
+MARGIN = 8
+WIDTH = 600
+
+FONTS = {
+    False: [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+        "/usr/share/fonts/TTF/DejaVuSansMono.ttf",
+    ],
+    True: [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSansMono-Bold.ttf",
+    ],
+}
+
+# Index in the palette, color, bold
+BACKGROUND = (0, "#222222")
+STYLES = {
+    None: (1, "#eeeeee", False),
+    "bold": (1, "#eeeeee", True),
+    "success": (2, "#7fff00", True),
+    "warning": (3, "#ffd700", False),
+    "danger": (4, "#ff0000", False),
+}
+
+MARKUP = re.compile(r"<style=(\w+)>(.*?)</style>")
+
+
+def parse(text):
+    """
+    Split each line of the summary into (text, style) chunks
+    """
+    for line in text.split("\n"):
+        chunks = []
+        position = 0
+        for match in MARKUP.finditer(line):
+            chunks.append((line[position : match.start()], None))
+            chunks.append((match.group(2), match.group(1)))
+            position = match.end()
+        chunks.append((line[position:], None))
+        yield [(chunk, style) for chunk, style in chunks if chunk]
+
+
+def rgb(color):
+    return tuple(int(color[i : i + 2], 16) for i in (1, 3, 5))
+
+
+def load_font(bold):
+    for path in FONTS[bold]:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, FONT_SIZE)
+    return ImageFont.load_default()
+
+
+GLYPHS = {}
+FONT_CACHE = {}
+
+
+def glyph(char, bold):
+    """
+    The 1-bit mask of a character, rasterized only once
+    """
+    if (char, bold) not in GLYPHS:
+        if bold not in FONT_CACHE:
+            FONT_CACHE[bold] = load_font(bold)
+        font = FONT_CACHE[bold]
+        mask = Image.new("1", (char_width(), LINE_HEIGHT))
+        draw = ImageDraw.Draw(mask)
+        draw.fontmode = "1"
+        draw.text((0, 1), char, font=font, fill=1)
+        GLYPHS[(char, bold)] = mask
+    return GLYPHS[(char, bold)]
+
+
+def char_width():
+    if "width" not in FONT_CACHE:
+        FONT_CACHE["width"] = round(load_font(False).getlength("M"))
+    return FONT_CACHE["width"]
+
+
+def render_png(text, output):
+    lines = list(parse(text))
+
+    image = Image.new("P", (WIDTH, len(lines) * LINE_HEIGHT + 2 * MARGIN))
+    palette = [BACKGROUND[1]] + [
+        color for _, (_, color, _) in sorted(STYLES.items(), key=lambda s: s[1][0])
+    ]
+    image.putpalette(
+        [c for color in dict.fromkeys(palette) for c in rgb(color)], rawmode="RGB"
+    )
+
+    y = MARGIN
+    for line in lines:
+        x = MARGIN
+        for chunk, style in line:
+            color, _, bold = STYLES.get(style, STYLES[None])
+            for char in chunk:
+                if x >= WIDTH:
+                    break
+                if not char.isspace():
+                    image.paste(color, (x, y), glyph(char, bold))
+                x += char_width()
+        y += LINE_HEIGHT
+
+    image.save(output, optimize=True)
+
+
+def render_svg(text, output):
+    lines = list(parse(text))
+    height = len(lines) * LINE_HEIGHT + 2 * MARGIN
+
+    svg = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}">',
+        f'<rect width="100%" height="100%" fill="{BACKGROUND[1]}"/>',
+        f'<g font-family="DejaVu Sans Mono, monospace" font-size="{FONT_SIZE}px" xml:space="preserve">',
+    ]
+    for i, line in enumerate(lines):
+        y = MARGIN + (i + 1) * LINE_HEIGHT - 4
+        spans = "".join(
+            '<tspan fill="{color}"{weight}>{chunk}</tspan>'.format(
+                color=STYLES.get(style, STYLES[None])[1],
+                weight=(
+                    ' font-weight="bold"' if STYLES.get(style, STYLES[None])[2] else ""
+                ),
+                chunk=html.escape(chunk),
+            )
+            for chunk, style in line
+        )
+        svg.append(f'<text x="{MARGIN}" y="{y}">{spans}</text>')
+    svg += ["</g>", "</svg>"]
+
+    with open(output, "w") as f:
+        f.write("\n".join(svg))
+
+
+def export(text, output):
+    """
+    Render as SVG or PNG depending on the extension of the output file
+    """
+    if output.endswith(".svg"):
+        render_svg(text, output)
+    elif Image is None:
+        print(
+            "(Protip™ for CI admin: you should 'pip install Pillow' to enable result summary export to .png)"
+        )
+    else:
+        render_png(text, output)
+
+
+def render_with_wkhtmltoimage(text, output):
+    # (The way summaries used to be rendered, kept for comparison in the benchmark)
+    import imgkit
+
+    text = (
+        text.replace(
+            "<style=success>", '<span style="color: chartreuse; font-weight: bold;">'
+        )
+        .replace("<style=warning>", '<span style="color: gold;">')
+        .replace("<style=danger>", '<span style="color: red;">')
+        .replace("<style=bold>", '<span style="font-weight: bold;">')
+        .replace("</style>", "</span>")
+    )
+    text = f"""
+<html style="color: #eee; background-color: #222; font-family: monospace">
+<body>
+<pre>
+{text}
+</pre>
+</body>
+</html>"""
+    imgkit.from_string(text, output, options={"crop-w": 600, "quiet": ""})
+    if os.path.exists("/usr/bin/optipng"):
+        os.system(f"/usr/bin/optipng --quiet '{output}'")
+
+
+SAMPLE_SUMMARY = "\n".join(
+    [""]
+    + [
+        "{: <30}{}".format(test, result)
+        for test, result in [
+            ("Package linter:", " <style=success>OK</style>  (3 warnings)"),
+            ("Install (root):", " <style=success>OK</style>"),
+            ("Install (subdir):", " <style=success>OK</style>"),
+            ("Install (multi):", "<style=danger>fail</style>"),
+            ("Backup/restore:", " <style=success>OK</style>"),
+            ("Upgrade:", " <style=success>OK</style>"),
+            ("Upgrade (abcdef12):", "<style=warning>skipped</style>"),
+            ("Change url:", " <style=success>OK</style>"),
+        ]
+    ]
+    + ["", "Level results", "============="]
+    + [
+        "Level {} {: <40}  <style=success>OK</style>".format(i, "(Some level)")
+        for i in range(1, 9)
+    ]
+    + ["", "<style=bold>Global level for this application: 8 (Some level)</style>", ""]
+)
+
+
+def benchmark(runs):
+    renderers = {"svg": (render_svg, ".svg"), "png": (render_png, ".png")}
+    if os.path.exists("/usr/bin/wkhtmltoimage"):
+        renderers["wkhtmltoimage"] = (render_with_wkhtmltoimage, ".png")
+    else:
+        print("(wkhtmltoimage is not installed, skipping it)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (render, extension) in renderers.items():
+            output = os.path.join(tmp, name + extension)
+            start = time.perf_counter()
+            for _ in range(runs):
+                render(SAMPLE_SUMMARY, output)
+            elapsed = (time.perf_counter() - start) / runs
+            print(
+                f"{name: <15} {elapsed * 1000:8.1f}ms per image, {os.path.getsize(output) / 1024:6.1f}KB"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--sample", help="Render the sample summary to this file")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.runs)
+    if args.sample:
+        export(SAMPLE_SUMMARY, args.sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import argparse
+import fcntl
+import heapq
+import json
+import os
+import statistics
+import time
+
+HISTORY_FILE = os.environ.get("TEST_HISTORY_FILE", "./test_history.jsonl")
+
+# How many of the latest runs of a test are kept (and used for predictions)
+MAX_ENTRIES_PER_TEST = 20
+
+# Rough durations (in seconds) of each type of test, when there's no history at all
+DEFAULT_DURATIONS = {
+    "TEST_PACKAGE_LINTER": 30,
+    "TEST_INSTALL": 300,
+    "TEST_UPGRADE": 300,
+    "TEST_BACKUP_RESTORE": 450,
+    "TEST_CHANGE_URL": 600,
+    "TEST_PORT_ALREADY_USED": 300,
+}
+
+
+def load_tests(test_context):
+    for test in sorted(os.listdir(test_context + "/tests")):
+        j = json.load(open(test_context + "/tests/" + test))
+        j["id"] = test.split(".")[0]
+        results_file = test_context + "/results/" + j["id"] + ".json"
+        j["results"] = (
+            json.load(open(results_file)) if os.path.exists(results_file) else {}
+        )
+        yield j
+
+
+def history_key(test):
+    # Install tests are quite different depending on the install type, but
+    # upgrades from older commits are just upgrades (and commits change anyway)
+    if test["test_type"] == "TEST_INSTALL":
+        return test["test_type"] + "." + test["test_arg"]
+    if test["test_type"] == "TEST_UPGRADE" and test["test_arg"]:
+        return test["test_type"] + ".from_commit"
+    return test["test_type"]
+
+
+def load_history():
+    if not os.path.exists(HISTORY_FILE):
+        return []
+    with open(HISTORY_FILE) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record(test_context):
+    """
+    Add the tests of a finished run to the history (only those which were
+    actually ran, i.e. not skipped nor reused from a previous run)
+    """
+
+    app = open(test_context + "/app_id").read().strip()
+    new_entries = [
+        {
+            "app": app,
+            "test": history_key(test),
+            "main_result": test["results"]["main_result"],
+            "duration": int(test["results"]["test_duration"]),
+            "peak_ram_usage": test["results"].get("peak_ram_usage"),
+            "timestamp": int(time.time()),
+        }
+        for test in load_tests(test_context)
+        if test["results"].get("main_result") in ["success", "failure"]
+        and not test["results"].get("cached")
+    ]
+
+    # (Several workers may share the same history)
+    with open(HISTORY_FILE, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        entries = [json.loads(line) for line in f if line.strip()] + new_entries
+
+        # Only keep the latest entries of each test of each app
+        kept = []
+        count = {}
+        for entry in reversed(entries):
+            key = (entry["app"], entry["test"])
+            count[key] = count.get(key, 0) + 1
+            if count[key] <= MAX_ENTRIES_PER_TEST:
+                kept.append(entry)
+
+        f.seek(0)
+        f.truncate()
+        for entry in reversed(kept):
+            f.write(json.dumps(entry) + "\n")
+
+
+def predict(app, tests, history=None):
+    """
+    Predicted duration (in seconds) and peak RAM usage (in MB, or None if
+    unknown) of each test, from the history of this app, or of all apps
+    """
+
+    if history is None:
+        history = load_history()
+
+    by_app_and_test = {}
+    by_test = {}
+    for entry in history:
+        by_app_and_test.setdefault((entry["app"], entry["test"]), []).append(entry)
+        by_test.setdefault(entry["test"], []).append(entry)
+
+    predictions = {}
+    for test in tests:
+        key = history_key(test)
+        entries = by_app_and_test.get((app, key)) or by_test.get(key) or []
+        durations = [e["duration"] for e in entries]
+        rams = [e["peak_ram_usage"] for e in entries if e.get("peak_ram_usage")]
+        predictions[test["id"]] = {
+            "duration": (
+                int(statistics.median(durations))
+                if durations
+                else DEFAULT_DURATIONS.get(test["test_type"], 300)
+            ),
+            "peak_ram_usage": int(max(rams)) if rams else None,
+            "from_history_of_this_app": (app, key) in by_app_and_test,
+        }
+
+    return predictions
+
+
+def order(tests, predictions):
+    """
+    Cheap and high-signal tests first: the linter, then the installs (which
+    create the snapshots other tests use), then the others from the cheapest
+    to the most expensive, while respecting the dependencies between tests
+    """
+
+    def priority(test):
+        if test["test_type"] == "TEST_PACKAGE_LINTER":
+            rank = 0
+        elif test["test_type"] == "TEST_INSTALL" and not test.get("depends_on"):
+            rank = 1
+        else:
+            rank = 2
+        return (rank, predictions[test["id"]]["duration"], test["id"])
+
+    tests = {test["id"]: test for test in tests}
+    waiting_for = {
+        id_: {str(dep) for dep in test.get("depends_on", []) if str(dep) in tests}
+        for id_, test in tests.items()
+    }
+    ready = [(priority(t), id_) for id_, t in tests.items() if not waiting_for[id_]]
+    heapq.heapify(ready)
+
+    ordered = []
+    while ready:
+        _, id_ = heapq.heappop(ready)
+        ordered.append(id_)
+        for other, deps in waiting_for.items():
+            if id_ in deps:
+                deps.remove(id_)
+                if not deps:
+                    heapq.heappush(ready, (priority(tests[other]), other))
+
+    return ordered
+
+
+def format_duration(seconds):
+    return "%dmin%02ds" % (seconds // 60, seconds % 60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["record", "predict", "order"])
+    parser.add_argument("test_context", help="Path to the test context folder")
+    parser.add_argument("--app", help="App id (default: read from the test context)")
+    parser.add_argument(
+        "--json", action="store_true", help="Output the predictions as JSON"
+    )
+    args = parser.parse_args()
+
+    if args.action == "record":
+        record(args.test_context)
+        return
+
+    app = args.app or open(args.test_context + "/app_id").read().strip()
+    tests = list(load_tests(args.test_context))
+    predictions = predict(app, tests)
+
+    if args.action == "order":
+        print("\n".join(order(tests, predictions)))
+    elif args.json:
+        print(
+            json.dumps(
+                {
+                    "app": app,
+                    "duration": sum(p["duration"] for p in predictions.values()),
+                    "tests": predictions,
+                },
+                indent=4,
+            )
+        )
+    else:
+        for test in tests:
+            prediction = predictions[test["id"]]
+            print(
+                "{id}  {test: <40} ~{duration}{ram}{source}".format(
+                    id=test["id"],
+                    test=f"{test['test_type']} {test['test_arg']} ({test['test_serie']})",
+                    duration=format_duration(prediction["duration"]),
+                    ram=(
+                        f", peak RAM ~{prediction['peak_ram_usage']}MB"
+                        if prediction["peak_ram_usage"]
+                        else ""
+                    ),
+                    source=(
+                        ""
+                        if prediction["from_history_of_this_app"]
+                        else " (no history for this app)"
+                    ),
+                )
+            )
+        total = sum(p["duration"] for p in predictions.values())
+        print(f"Predicted total duration: ~{format_duration(total)}")
+
+
+if __name__ == "__main__":
+    main()
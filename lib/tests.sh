@@ -10,9 +10,6 @@ _STUFF_TO_RUN_BEFORE_INITIAL_SNAPSHOT() {
     log_small_title "YunoHost versions"
     $lxc exec "$LXC_NAME" -t -- /bin/bash -c "yunohost --version" | tee -a "$full_log"
 
-    log_title "Package linter"
-    ./package_linter/package_linter.py "$package_path" | tee -a "$full_log"
-
     # Set witness files
     set_witness_files
 
@@ -42,20 +39,16 @@ _STUFF_TO_RUN_BEFORE_INITIAL_SNAPSHOT() {
         exit 0
     fi
 
-    # We filter apt deps starting with $app_id to prevent stupid issues with for example cockpit and transmission where the apt package is not properly reinstalled on reinstall-after-remove test ...
-    local apt_deps=$(python3 -c "import toml, sys; t = toml.loads(sys.stdin.read()); P = t['resources'].get('apt', {}).get('packages', ''); P = P.replace(',', ' ').split() if isinstance(P, str) else P; P = [p for p in P if p != '$app_id' and not p.startswith('$app_id-')]; print(' '.join(P));" < "$package_path/manifest.toml")
+    local apt_deps=$(_APT_DEPS_TO_PREINSTALL)
 
-    if [[ -n "$apt_deps" ]]; then
+    if [[ "${SNAPSHOT_CACHE_HIT:-false}" == "true" ]]; then
+        log_info "(Apt dependencies are already installed in the cached image)"
+    elif [[ -n "$apt_deps" ]]; then
 
-        # This bit is copypasta of the apt helpers
-        local specific_php_version=$(grep -oP '(?<=php)[0-9.]+(?=-|\>|)' <<< "$apt_deps" | sort -u)
-        if [[ -n "$specific_php_version" ]]; then
-            # Cover a small edge case where a packager could have specified "php7.4-pwet php5-gni" which is confusing
-            [[ $(echo "$specific_php_version" | wc -l) -eq 1 ]] \
-                || log_critical "Inconsistent php versions in dependencies ... found : $specific_php_version"
-
-            apt_deps+=" php${specific_php_version} php${specific_php_version}-fpm php${specific_php_version}-common"
-        fi
+        # (The php version is already added to the dependencies by parse_tests_toml.py)
+        # Cover a small edge case where a packager could have specified "php7.4-pwet php5-gni" which is confusing
+        [[ "$(jq '.php_versions | length' "$test_plan")" -le 1 ]] \
+            || log_critical "Inconsistent php versions in dependencies ... found : $(jq -r '.php_versions | join(" ")' "$test_plan")"
 
         log_title "Preinstalling apt dependencies before creating the initial snapshot..."
 
@@ -64,25 +57,96 @@ _STUFF_TO_RUN_BEFORE_INITIAL_SNAPSHOT() {
     fi
 
     # Gotta generate the psql password even though apparently it's not even useful anymore these days but it otherwise trigger warnings ~_~
-    if echo "$apt_deps" | grep -q postgresql; then
+    if [[ "${SNAPSHOT_CACHE_HIT:-false}" != "true" ]] && echo "$apt_deps" | grep -q postgresql; then
         $lxc exec "$LXC_NAME" -t -- /bin/bash -c "yunohost tools regen-conf postgresql" | tee -a "$full_log" >/dev/null
     fi
 }
 
+_LINTER_START() {
+    # The linter runs once, in --json mode, in the background while the container gets created
+    # (cf _LINTER_REPORT). Its results are cached for a given commit of the app and of the linter.
+    local cache_key=$(_LINTER_CACHE_KEY)
+    if [[ -n "$cache_key" ]] && [[ -e "$linter_cache_dir/$cache_key.json" ]]; then
+        log_debug "Reusing the results of the linter for this commit"
+        cp "$linter_cache_dir/$cache_key.json" "$TEST_CONTEXT/linter.json"
+        cp "$linter_cache_dir/$cache_key.exit" "$TEST_CONTEXT/linter.exit"
+        touch "$linter_cache_dir/$cache_key.json" "$linter_cache_dir/$cache_key.exit"
+        linter_pid=""
+        return
+    fi
+
+    (
+        ./package_linter/package_linter.py "$package_path" --json > "$TEST_CONTEXT/linter.json" 2> "$TEST_CONTEXT/linter.stderr"
+        echo $? > "$TEST_CONTEXT/linter.exit"
+        # (Not when it failed to run at all, e.g. because of the network)
+        if [[ -n "$cache_key" ]] && jq -e . "$TEST_CONTEXT/linter.json" >/dev/null 2>&1; then
+            mkdir -p "$linter_cache_dir"
+            cp "$TEST_CONTEXT/linter.json" "$linter_cache_dir/$cache_key.json"
+            cp "$TEST_CONTEXT/linter.exit" "$linter_cache_dir/$cache_key.exit"
+        fi
+    ) &
+    linter_pid=$!
+}
+
+_LINTER_CACHE_KEY() {
+    # (Nothing is cached for uncommitted changes, or with --no-cache)
+    [ "$use_results_cache" -eq 1 ] || return 0
+    [[ -z "$(git -C "$package_path" status --porcelain 2>/dev/null)" ]] || return 0
+    local app_commit=$(git -C "$package_path" rev-parse HEAD 2>/dev/null)
+    local linter_commit=$(git -C ./package_linter rev-parse HEAD 2>/dev/null)
+    [[ -n "$app_commit" ]] && [[ -n "$linter_commit" ]] || return 0
+
+    find "$linter_cache_dir" -type f -mtime "+$LINTER_CACHE_MAX_AGE" -delete 2>/dev/null
+    echo "$app_commit $linter_commit" | sha256sum | cut -d' ' -f1
+}
+
+_LINTER_REPORT() {
+    # Waits for the linter, and displays its results (from its JSON output, which gives the checks by level)
+    [[ -z "${linter_pid:-}" ]] || wait "$linter_pid"
+
+    log_title "Package linter"
+    local results="$TEST_CONTEXT/linter.json"
+    [[ ! -s "$TEST_CONTEXT/linter.stderr" ]] || tee -a "$full_log" < "$TEST_CONTEXT/linter.stderr"
+    if ! jq -e . "$results" >/dev/null 2>&1; then
+        log_error "The package linter failed to run"
+        return
+    fi
+
+    local level check
+    while read -r level check; do
+        case $level in
+            critical|error) log_error "[$level] $check" ;;
+            warning) log_warning "$check" ;;
+            info) log_info "[info] $check" ;;
+        esac
+    done < <(jq -r '["critical", "error", "warning", "info"][] as $level | .[$level] // [] | .[]
+        | "\($level) \(if type == "string" then . else (.message // tostring) end)"' "$results")
+    log_success "$(jq -r '.success // [] | length' "$results") checks passed"
+}
+
+_APT_DEPS_TO_PREINSTALL() {
+    # (Without the deps starting with $app_id, cf apt_deps_to_preinstall in parse_tests_toml.py)
+    jq -r '.apt_deps' "$test_plan"
+}
+
 _RUN_YUNOHOST_CMD() {
 
     log_debug "Running yunohost $1"
 
-    # Copy the package into the container.
-    $lxc exec "$LXC_NAME" -- rm -rf /app_folder
-    $lxc file push -p -r "$package_path" "$LXC_NAME/app_folder" --quiet
+    # Copy the package into the container (only what changed since the previous command, if anything)
+    local sync_log
+    if sync_log=$(python3 lib/app_folder_sync.py "$package_path" "$LXC_NAME" --lxc "$lxc" --state "$(_APP_FOLDER_SYNC_STATE)"); then
+        log_debug "$sync_log"
+    else
+        log_warning "Failed to sync /app_folder in the container, pushing it all again"
+        $lxc exec "$LXC_NAME" -- rm -rf /app_folder /var/cache/package_check/app_folder.json
+        $lxc file push -p -r "$package_path" "$LXC_NAME/app_folder" --quiet
+    fi
 
     # --output-as none is to disable the json-like output for some commands like backup create
-    LXC_EXEC "yunohost --output-as none --debug $1" \
-        | grep --line-buffered -v --extended-regexp '^[0-9]+\s+.{1,15}DEBUG' \
-        | grep --line-buffered -v 'processing action'
+    LXC_EXEC "yunohost --output-as none --debug $1" filter_debug
 
-    returncode=${PIPESTATUS[0]}
+    returncode=$?
     check_witness_files && return "$returncode" || return 2
 }
 
@@ -93,7 +157,7 @@ _PREINSTALL() {
     if [ -n "$preinstall_template" ]; then
         log_small_title "Running pre-install steps before snapshoting..."
         # Copy all the instructions into a script
-        local preinstall_script="$TEST_CONTEXT/preinstall.sh"
+        local preinstall_script="$current_test_tmp/preinstall.sh"
         cat <<EOF > "$preinstall_script"
 USER=$TEST_USER
 DOMAIN=$DOMAIN
@@ -119,7 +183,7 @@ _PREUPGRADE() {
     if [ -n "$preupgrade_template" ]; then
         log_small_title "Running pre-upgrade steps"
         # Copy all the instructions into a script
-        local preupgrade_script="$TEST_CONTEXT/preupgrade.sh"
+        local preupgrade_script="$current_test_tmp/preupgrade.sh"
         cat <<EOF > "$preupgrade_script"
 USER=$TEST_USER
 DOMAIN=$DOMAIN
@@ -171,6 +235,8 @@ _INSTALL_APP() {
     # Fetch and loop over all manifest arg ... NB : we need to keep this as long as there are "upgrade from packaging v1" tests
     if [[ -e $package_path/manifest.json ]]; then
         local manifest_args="$(jq -r '.arguments.install[].name' "$package_path/manifest.json")"
+    elif test_plan_applies_to manifest.toml; then
+        local manifest_args="$(jq -r '.install_args[]' "$test_plan")"
     else
         local manifest_args="$(grep -oE '^\s*\[install\.\w+]' "$package_path/manifest.toml" | tr -d '[]' | awk -F. '{print $2}')"
     fi
@@ -181,6 +247,8 @@ _INSTALL_APP() {
             # NB : we need to keep this as long as there are "upgrade from packaging v1" tests
             if [[ -e $package_path/manifest.json ]]; then
                 local default_value=$(jq -e -r --arg ARG "$ARG" '.arguments.install[] | select(.name==$ARG) | .default' "$package_path/manifest.json")
+            elif test_plan_applies_to manifest.toml; then
+                local default_value=$(jq -e -r --arg ARG "$ARG" '.install_args_defaults[$ARG]' "$test_plan")
             else
                 local default_value=$(python3 -c "import toml, sys; t = toml.loads(sys.stdin.read()); d = t['install']['$ARG'].get('default'); assert d is not None, 'Missing default value'; print(d)" < "$package_path/manifest.toml")
             fi
@@ -287,11 +355,13 @@ _VALIDATE_THAT_APP_CAN_BE_ACCESSED() {
 
     log_small_title "Validating that the app $app_id_to_check can/can't be accessed with its URL..."
 
-    if [ -e "$package_path/tests.toml" ]; then
-        python3 -c "import toml, sys; t = toml.loads(sys.stdin.read()); print(toml.dumps(t['$current_test_serie'].get('curl_tests', {})))" <"$package_path/tests.toml" > "$TEST_CONTEXT/curl_tests.toml"
+    if test_plan_applies_to tests.toml; then
+        jq -r --arg serie "$current_test_serie" '.curl_tests[$serie] // ""' "$test_plan" > "$current_test_tmp/curl_tests.toml"
+    elif [ -e "$package_path/tests.toml" ]; then
+        python3 -c "import toml, sys; t = toml.loads(sys.stdin.read()); print(toml.dumps(t['$current_test_serie'].get('curl_tests', {})))" <"$package_path/tests.toml" > "$current_test_tmp/curl_tests.toml"
     # Upgrade from older versions may still be in packaging v1 without a tests.toml
     else
-        echo "" > "$TEST_CONTEXT/curl_tests.toml"
+        echo "" > "$current_test_tmp/curl_tests.toml"
     fi
 
     DIST="$DIST" \
@@ -301,7 +371,9 @@ _VALIDATE_THAT_APP_CAN_BE_ACCESSED() {
         PASSWORD="$YUNO_PWD" \
         LXC_IP="$LXC_IP" \
         BASE_URL="https://$domain_to_check$path_to_check" \
-        python3 lib/curl_tests.py < "$TEST_CONTEXT/curl_tests.toml" | tee -a "$full_log"
+        CURL_TESTS_RESULTS="$TEST_CONTEXT/curl_results/$current_test_id.json" \
+        CURL_TESTS_SOCKET="$curl_tests_socket" \
+        python3 lib/curl_tests_client.py < "$current_test_tmp/curl_tests.toml" | tee -a "$full_log"
 
     curl_result=${PIPESTATUS[0]}
 
@@ -335,10 +407,10 @@ TEST_PACKAGE_LINTER() {
 
     start_test "Package linter"
 
-    # Execute package linter and linter_result gets the return code of the package linter
-    ./package_linter/package_linter.py "$package_path" --json | tee -a "$full_log" > "$current_test_results"
+    # The package linter already ran, cf _LINTER_START
+    tee -a "$full_log" < "$TEST_CONTEXT/linter.json" | results_store import "$current_test_id"
 
-    return "${PIPESTATUS[0]}"
+    return "$(cat "$TEST_CONTEXT/linter.exit" 2>/dev/null || echo 1)"
 }
 
 TEST_INSTALL() {
@@ -515,9 +587,9 @@ TEST_PORT_ALREADY_USED() {
 
     # Build a service with netcat for use this port before the app.
     echo -e "[Service]\nExecStart=/bin/netcat -l -k -p $check_port\n
-    [Install]\nWantedBy=multi-user.target" > "$TEST_CONTEXT/netcat.service"
+    [Install]\nWantedBy=multi-user.target" > "$current_test_tmp/netcat.service"
 
-    $lxc file push "$TEST_CONTEXT/netcat.service" "$LXC_NAME/etc/systemd/system/netcat.service"
+    $lxc file push "$current_test_tmp/netcat.service" "$LXC_NAME/etc/systemd/system/netcat.service"
 
     # Then start this service to block this port.
     LXC_EXEC "systemctl enable --now netcat"
@@ -529,6 +601,35 @@ TEST_PORT_ALREADY_USED() {
     return $?
 }
 
+_ATTACH_BACKUP_ARCHIVES() {
+    # The archives are written directly on the host, in the test context (i.e. in --storage-dir),
+    # so that they survive the restore of the snapshots without being copied back and forth
+    [[ "$backup_handoff" == "volume" ]] || return 1
+    # (Detach it first, not to remove the archives on the host through it!)
+    LXC_DETACH_DIR ynh_backups
+    RUN_INSIDE_LXC rm -rf /home/yunohost.backup/archives
+    LXC_ATTACH_DIR ynh_backups "$backup_archives" /home/yunohost.backup/archives && return 0
+
+    log_debug "Could not attach $backup_archives to the container, copying the backup archives instead"
+    backup_handoff="copy"
+    return 1
+}
+
+_RECORD_BACKUP_THROUGHPUT() {
+    # $1 = backup or restore, $2 = $EPOCHREALTIME when it started, $3 = when it ended (default: now)
+    local operation=$1
+    local seconds=$(awk -v start="$2" -v end="${3:-$EPOCHREALTIME}" 'BEGIN{printf "%.1f\n", end - start}')
+    local bytes=$(du -sb "$backup_archives" | cut -f1)
+
+    local stats=$(jq -nc --arg operation "$operation" --arg path "$check_path" --arg handoff "$backup_handoff" \
+        --argjson seconds "$seconds" --argjson bytes "$bytes" \
+        '{$operation, $path, $handoff, $seconds, size_mb: ($bytes / 1048576 * 10 | round / 10),
+          mb_per_s: (if $seconds > 0 then ($bytes / 1048576 / $seconds * 10 | round / 10) else null end)}')
+    results_store set "$current_test_id" backup_throughput "$stats" --json --append
+
+    log_info "$(echo "$stats" | jq -r '"\(.operation | ascii_upcase[0:1] + .[1:]) of \(.size_mb)MB in \(.seconds)s (\(.mb_per_s // "-")MB/s)"')"
+}
+
 TEST_BACKUP_RESTORE() {
 
     # Try to backup then restore the app
@@ -548,16 +649,21 @@ TEST_BACKUP_RESTORE() {
     fi
 
     local main_result=0
+    local backup_archives="$current_test_tmp/ynh_backups/archives"
+    local backup_handoff="volume"
 
     for check_path in "${check_paths[@]}"; do
+        # (The archives must not be part of the snapshots taken in the meantime)
+        LXC_DETACH_DIR ynh_backups
+
         # Install the application in a LXC container
         _LOAD_SNAPSHOT_OR_INSTALL_APP "$check_path"
 
         local ret=$?
 
         # Remove the previous residual backups
-        rm -rf "$TEST_CONTEXT/ynh_backups"
-        RUN_INSIDE_LXC rm -rf /home/yunohost.backup/archives
+        rm -rf "$current_test_tmp/ynh_backups"
+        _ATTACH_BACKUP_ARCHIVES || RUN_INSIDE_LXC rm -rf /home/yunohost.backup/archives
 
         # BACKUP
         # Made a backup if the installation succeed
@@ -570,6 +676,7 @@ TEST_BACKUP_RESTORE() {
             log_small_title "Backup of the application..."
 
             # Made a backup of the application
+            local backup_start=$EPOCHREALTIME
             _RUN_YUNOHOST_CMD "backup create -n Backup_test --apps $app_id"
             ret=$?
         fi
@@ -580,8 +687,14 @@ TEST_BACKUP_RESTORE() {
             continue
         }
 
-        # Grab the backup archive into the LXC container, and keep a copy
-        $lxc file pull -r "$LXC_NAME/home/yunohost.backup/archives" "$TEST_CONTEXT/ynh_backups/"
+        # (Not counting the copy of the archive to the host below, such that both handoffs compare)
+        local backup_end=$EPOCHREALTIME
+
+        # Grab the backup archive into the LXC container, and keep a copy (unless it's already on the host)
+        if [[ "$backup_handoff" == "copy" ]]; then
+            $lxc file pull -r "$LXC_NAME/home/yunohost.backup/archives" "$current_test_tmp/ynh_backups/"
+        fi
+        _RECORD_BACKUP_THROUGHPUT backup "$backup_start" "$backup_end"
 
         # RESTORE
         # Try the restore process in 2 times, first after removing the app, second after a restore of the container.
@@ -599,22 +712,27 @@ TEST_BACKUP_RESTORE() {
 
                 _LOAD_PREINSTALL_SNAPSHOT
 
-                # Remove the previous residual backups
-                RUN_INSIDE_LXC rm -rf /home/yunohost.backup/archives
-
-                # Place the copy of the backup archive in the container.
-                $lxc file push -r "$TEST_CONTEXT/ynh_backups/archives" "$LXC_NAME/home/yunohost.backup/"
+                # Place the backup archive in the container again (the snapshot detached it)
+                if ! _ATTACH_BACKUP_ARCHIVES; then
+                    # Remove the previous residual backups
+                    RUN_INSIDE_LXC rm -rf /home/yunohost.backup/archives
+                    $lxc file push -r "$backup_archives" "$LXC_NAME/home/yunohost.backup/"
+                fi
 
                 log_small_title "Restore on a fresh YunoHost system..."
             fi
 
             # Restore the application from the previous backup
             metrics_start
-            _RUN_YUNOHOST_CMD "backup restore Backup_test --no-remove-on-failure --force --apps $app_id" \
-                && _VALIDATE_THAT_APP_CAN_BE_ACCESSED "$SUBDOMAIN" "$check_path" \
-                && _TEST_CONFIG_PANEL
-
+            local restore_start=$EPOCHREALTIME
+            _RUN_YUNOHOST_CMD "backup restore Backup_test --no-remove-on-failure --force --apps $app_id"
             ret=$?
+            if [ $ret -eq 0 ]; then
+                _RECORD_BACKUP_THROUGHPUT restore "$restore_start"
+                _VALIDATE_THAT_APP_CAN_BE_ACCESSED "$SUBDOMAIN" "$check_path" \
+                    && _TEST_CONFIG_PANEL
+                ret=$?
+            fi
             metrics_stop
             [ $ret -eq 0 ] || main_result=1
 
@@ -622,6 +740,8 @@ TEST_BACKUP_RESTORE() {
         done
     done
 
+    LXC_DETACH_DIR ynh_backups
+
     return $main_result
 }
 
@@ -26,10 +26,23 @@ run_all_tests() {
     mkdir -p "$TEST_CONTEXT/tests"
     mkdir -p "$TEST_CONTEXT/results"
     mkdir -p "$TEST_CONTEXT/logs"
+    mkdir -p "$TEST_CONTEXT/curl_results"
+
+    local parse_args=()
+    if [ "$use_results_cache" -eq 1 ]; then
+        local base_fingerprint="$(LXC_BASE_FINGERPRINT)"
+        [[ -z "$base_fingerprint" ]] || parse_args+=(--base-image "$base_fingerprint")
+        mkdir -p "$results_cache_dir"
+        find "$results_cache_dir" -type f -mtime "+$RESULTS_CACHE_MAX_AGE" -delete
+    fi
 
-    readonly app_id="$(grep '^id = ' "$package_path/manifest.toml" | tr -d '" ' | awk -F= '{print $2}')"
+    readonly test_plan="$TEST_CONTEXT/test_plan.json"
+    DIST=$DIST "./lib/parse_tests_toml.py" "$package_path" --dump-to "$TEST_CONTEXT/tests" --plan "$test_plan" "${parse_args[@]}"
 
-    DIST=$DIST "./lib/parse_tests_toml.py" "$package_path" --dump-to "$TEST_CONTEXT/tests"
+    # Everything about the app is in the test plan, read it once and for all
+    readonly app_id="$(jq -r '.app_id' "$test_plan")"
+    readonly install_types=" $(jq -r '.install_types | join(" ")' "$test_plan") "
+    jq -r '.version' "$test_plan" > "$TEST_CONTEXT/app_version"
 
     # Start the timer for this test
     start_timer
@@ -45,6 +58,7 @@ run_all_tests() {
         for FILE in "$TEST_CONTEXT/tests"/*.json; do
             jq "." "$FILE"
         done
+        python3 lib/test_history.py predict "$TEST_CONTEXT" --app "$app_id"
         exit
     fi
 
@@ -52,28 +66,49 @@ run_all_tests() {
     cat "$TEST_CONTEXT/tests"/*.json >>/proc/self/fd/3
 
     # Reset and create a fresh container to work with
-    check_lxc_setup
-    LXC_RESET
+    # (in batch mode, the setup was checked once and for all, and the container may come from the pool)
+    [[ -n "${batch_dir:-}" ]] || check_lxc_setup
+    [[ -n "${LXC_FROM_POOL:-}" ]] || LXC_RESET
+    _LINTER_START
     LXC_CREATE
+    _LINTER_REPORT
 
     LXC_EXEC "yunohost --version --output-as json" | jq -r .yunohost.version >> "$TEST_CONTEXT/ynh_version"
     LXC_EXEC "yunohost --version --output-as json" | jq -r .yunohost.repo >> "$TEST_CONTEXT/ynh_branch"
     echo "$ARCH" > "$TEST_CONTEXT/architecture"
     echo "$app_id" > "$TEST_CONTEXT/app_id"
 
-    # Init the value for the current test
-    current_test_number=1
+    # Keep a curl tests worker warm for all the validations of the app
+    # (cf lib/curl_tests_client.py, which runs curl_tests.py itself if the worker isn't there)
+    readonly curl_tests_socket="$TEST_CONTEXT/curl_tests.sock"
+    python3 lib/curl_tests.py --serve "$curl_tests_socket" &
 
-    # The list of test contains for example "TEST_UPGRADE some_commit_id
-    for testfile in "$TEST_CONTEXT"/tests/*.json; do
-        TEST_LAUNCHER "$testfile"
-        current_test_number=$((current_test_number + 1))
-    done
+    level_tracker_start
+    if [ "$PARALLEL_JOBS" -gt 1 ] && [ "$interactive" -eq 0 ] && [ "$interactive_on_errors" -eq 0 ]; then
+        run_tests_in_parallel
+    else
+        # Init the value for the current test
+        current_test_number=1
+
+        # The list of test contains for example "TEST_UPGRADE some_commit_id
+        for test_id in $(tests_in_order); do
+            TEST_LAUNCHER "$TEST_CONTEXT/tests/$test_id.json"
+            current_test_number=$((current_test_number + 1))
+            min_level_is_unreachable "$test_id" && break
+        done
+    fi
+    level_tracker_stop
+
+    skip_remaining_tests
+    results_store compact
+    LXC_READINESS_REPORT
+    APT_CACHE_REPORT
 
     # Print the final results of the tests
     log_title "Tests summary"
 
     python3 lib/analyze_test_results.py "$TEST_CONTEXT" 2> "$result_json"
+    python3 lib/test_history.py record "$TEST_CONTEXT"
     if [[ -e "$TEST_CONTEXT/summary.png" ]]; then
         cp "$TEST_CONTEXT/summary.png" "$summary_png"
     else
@@ -91,6 +126,202 @@ run_all_tests() {
 
 }
 
+run_tests_in_parallel() {
+    # Run the tests on $PARALLEL_JOBS containers: $LXC_NAME and clones of its snap0.
+    # A test starts as soon as a container is free and the tests it depends on are done,
+    # preferably on the container which ran one of those (to reuse its install snapshots)
+
+    local slot
+    local -a free_slots=()
+    local -A lxc_name_of_slot=()
+    for slot in $(seq 1 "$PARALLEL_JOBS"); do
+        if [ "$slot" -eq 1 ]; then
+            lxc_name_of_slot[$slot]="$LXC_NAME"
+        else
+            lxc_name_of_slot[$slot]="$LXC_NAME-$slot"
+            LXC_CLONE "${lxc_name_of_slot[$slot]}"
+            # Each container gets its own copy of the app, because upgrade tests checkout older commits in it
+            rm -rf "$TEST_CONTEXT/app_folder_$slot"
+            cp -a "$package_path" "$TEST_CONTEXT/app_folder_$slot"
+        fi
+        free_slots+=("$slot")
+    done
+    LXC_STOP "$LXC_NAME"
+
+    local testfile
+    local test_id
+    local -a pending=()
+    local -A test_number=() depends_on=() done_on_slot=() slot_of_pid=() test_of_pid=()
+    for test_id in $(tests_in_order); do
+        testfile="$TEST_CONTEXT/tests/$test_id.json"
+        pending+=("$test_id")
+        test_number[$test_id]=${#pending[@]}
+        depends_on[$test_id]="$(jq -r '.depends_on // [] | .[]' "$testfile")"
+    done
+
+    while [ ${#pending[@]} -gt 0 ] || [ ${#slot_of_pid[@]} -gt 0 ]; do
+
+        # Start as many tests as possible
+        while [ ${#free_slots[@]} -gt 0 ]; do
+            slot=${free_slots[0]}
+            local next_test=""
+            for test_id in "${pending[@]}"; do
+                local ready=true
+                local affinity=false
+                local dep
+                for dep in ${depends_on[$test_id]}; do
+                    [ -n "${done_on_slot[$dep]:-}" ] || ready=false
+                    [ "${done_on_slot[$dep]:-}" != "$slot" ] || affinity=true
+                done
+                [ "$ready" == true ] || continue
+                [ -n "$next_test" ] || next_test=$test_id
+                if [ "$affinity" == true ]; then
+                    next_test=$test_id
+                    break
+                fi
+            done
+            [ -n "$next_test" ] || break
+
+            log_debug "Starting test $next_test on ${lxc_name_of_slot[$slot]}"
+            local slot_package_path="$package_path"
+            [ "$slot" -eq 1 ] || slot_package_path="$TEST_CONTEXT/app_folder_$slot"
+            LXC_NAME="${lxc_name_of_slot[$slot]}" \
+            package_path="$slot_package_path" \
+            current_test_number=${test_number[$next_test]} \
+                TEST_LAUNCHER "$TEST_CONTEXT/tests/$next_test.json" \
+                < /dev/null > "$TEST_CONTEXT/logs/$next_test.out" 2>&1 &
+            slot_of_pid[$!]=$slot
+            test_of_pid[$!]=$next_test
+
+            local -a remaining=()
+            for test_id in "${pending[@]}"; do
+                [ "$test_id" == "$next_test" ] || remaining+=("$test_id")
+            done
+            pending=("${remaining[@]}")
+            free_slots=("${free_slots[@]:1}")
+        done
+
+        if [ ${#slot_of_pid[@]} -eq 0 ]; then
+            # Nothing running and nothing can start: shouldn't happen unless the dependencies are broken
+            log_error "Can't run the remaining tests ${pending[*]}, they depend on tests that don't exist ?"
+            break
+        fi
+
+        # Wait for any test to finish, and display its output all at once
+        local pid
+        wait -n -p pid "${!slot_of_pid[@]}"
+        test_id=${test_of_pid[$pid]}
+        cat "$TEST_CONTEXT/logs/$test_id.out"
+        done_on_slot[$test_id]=${slot_of_pid[$pid]}
+        free_slots+=("${slot_of_pid[$pid]}")
+        unset "slot_of_pid[$pid]" "test_of_pid[$pid]"
+
+        # Don't start anything else, but let the running tests finish
+        [ ${#pending[@]} -eq 0 ] || ! min_level_is_unreachable "$test_id" || pending=()
+    done
+
+    LXC_RESET_CLONES
+    for slot in $(seq 2 "$PARALLEL_JOBS"); do
+        rm -rf "$TEST_CONTEXT/app_folder_$slot"
+    done
+}
+
+run_batch() {
+    # Test the apps of a queue file (one path or URL per line) one after the other, with a single
+    # setup, while containers are launched in advance for the next apps (cf LXC_POOL_FILL).
+    # The file is only read, so apps can be appended to it while the batch runs.
+    local queue=$1
+    [[ -e "$queue" ]] || log_critical "Can't find the queue $queue"
+
+    batch_dir=$(mktemp -d "${storage_dir:-/tmp}/package_check_batch.XXXXXX")
+    local batch_results="./batch_results_${WORKER_ID}"
+    local stats="$batch_results/stats.jsonl"
+    mkdir -p "$batch_dir/pool" "$batch_results"
+    rm -f "$stats"
+
+    check_lxc_setup
+    LXC_POOL_RESET
+    LXC_POOL_FILL "$batch_dir/pool" &
+    local pool_fill_pid=$!
+
+    local n=0
+    local idle_since=$SECONDS
+    while true; do
+        local app=$(_batch_queue "$queue" | sed -n "$((n + 1))p")
+        if [[ -z "$app" ]]; then
+            [ $((SECONDS - idle_since)) -lt "$BATCH_IDLE_TIMEOUT" ] || break
+            sleep 10
+            continue
+        fi
+        n=$((n + 1))
+        local dequeued_at=$EPOCHREALTIME
+        local queue_depth=$(( $(_batch_queue "$queue" | wc -l) - n ))
+
+        log_title "Batch: app $n, $app ($queue_depth more in the queue)"
+
+        local from_pool=$(LXC_POOL_TAKE "$batch_dir/pool")
+        # Launch the next ones while this app is tested
+        kill -0 "$pool_fill_pid" 2>/dev/null || { LXC_POOL_FILL "$batch_dir/pool" & pool_fill_pid=$!; }
+
+        local app_context=$(mktemp -d "$batch_dir/package_check.XXXXXX")
+        ( _batch_test_app "$app" "$app_context" "$from_pool" )
+
+        local app_id=$(cat "$app_context/app_id" 2>/dev/null || echo "app_$n")
+        local app_results="$batch_results/$(printf "%03d" "$n")_$app_id"
+        mkdir -p "$app_results"
+        cp "$full_log" "$app_results/full_log.log"
+        cp "$result_json" "$summary_png" "$app_results/" 2>/dev/null
+
+        # How long the app waited until its container was ready for the first test
+        local app_stats=$(jq -c -n --arg app "$app" --arg app_id "$app_id" --argjson queue_depth "$queue_depth" --argjson dequeued_at "$dequeued_at" \
+            --argjson created "$(cat "$app_context/lxc_create.json" 2>/dev/null || echo '{}')" \
+            '{$app, $app_id, $queue_depth, pool: ($created.pool // "failed"), launch: $created.launch,
+              wait: (if $created.ready_at then ($created.ready_at - $dequeued_at) * 10 | round / 10 else null end)}')
+        echo "$app_stats" >> "$stats"
+        log_info "$(echo "$app_stats" | jq -r 'if .wait then "\(.app_id) waited \(.wait)s for its container (pool \(.pool))" else "\(.app_id) failed before getting a container" end')"
+
+        rm -rf "$app_context"
+        idle_since=$SECONDS
+    done
+
+    kill "$pool_fill_pid" 2>/dev/null
+    wait "$pool_fill_pid" 2>/dev/null
+    LXC_POOL_RESET
+    rm -rf "$batch_dir"
+
+    [[ -s "$stats" ]] || return 0
+    log_title "Batch summary"
+    log_info "$(jq -rs '(map(select(.pool == "hit")) | length) as $hits
+        | "\(length) apps tested, pool hit rate: \($hits * 100 / length | round)% (\($hits)/\(length)), "
+        + "waited \(map(.wait // empty) | if length > 0 then add / length * 10 | round / 10 else "-" end)s on average before the first test, "
+        + "queue depth up to \(map(.queue_depth) | max)"' "$stats")"
+    log_info "The results of each app are in $batch_results"
+}
+
+_batch_test_app() {
+    # Ran in a subshell: everything set here (even readonly) is only for this app,
+    # and exiting because of a critical error only stops this app
+    local app=$1
+    readonly TEST_CONTEXT=$2
+    local from_pool=$3
+    if [[ -n "$from_pool" ]]; then
+        LXC_NAME=${from_pool% *}
+        LXC_FROM_POOL=${from_pool#* }
+    fi
+    gitbranch=""
+    : > "$full_log"
+    rm -f "$result_json" "$summary_png"
+    trap 'jobs -p | xargs -r kill 2>/dev/null; LXC_RESET_CLONES; LXC_RESET' EXIT
+
+    fetch_package_to_test "$app"
+    run_all_tests
+}
+
+_batch_queue() {
+    # The apps of the queue, without comments and blank lines
+    grep -v -e '^\s*#' -e '^\s*$' "$1" | sed 's/^\s*//; s/\s*$//'
+}
+
 TEST_LAUNCHER() {
     local testfile="$1"
 
@@ -104,12 +335,25 @@ TEST_LAUNCHER() {
     current_test_infos="$TEST_CONTEXT/tests/$current_test_id.json"
     current_test_results="$TEST_CONTEXT/results/$current_test_id.json"
     current_test_log="$TEST_CONTEXT/logs/$current_test_id.log"
-    echo "{}" > "$current_test_results"
+    current_test_tmp="$TEST_CONTEXT/tmp/$current_test_id"
+    mkdir -p "$current_test_tmp"
+    results_store import "$current_test_id" <<< "{}"
     echo "" > "$current_test_log"
 
     local test_type=$(jq -r '.test_type' "$testfile")
     local test_arg=$(jq -r '.test_arg' "$testfile")
 
+    local cache_key=$(results_cache_key "$testfile")
+    if [[ -n "$cache_key" ]] && [[ -e "$results_cache_dir/$cache_key.json" ]]; then
+        start_test "${test_type#TEST_} $test_arg"
+        log_info "(Reusing the result of a previous run, the inputs of this test didn't change)"
+        jq '.cached = true' "$results_cache_dir/$cache_key.json" | results_store import "$current_test_id"
+        cp "$results_cache_dir/$cache_key.log" "$current_test_log" 2>/dev/null
+        touch "$results_cache_dir/$cache_key.json" "$results_cache_dir/$cache_key.log"
+        log_report_test_success
+        return
+    fi
+
     # Execute the test
     # shellcheck disable=SC2086
     $test_type $test_arg
@@ -127,9 +371,18 @@ TEST_LAUNCHER() {
         RUN_INSIDE_LXC yunohost tools shell -c "from yunohost.log import log_list, log_share; log_share(log_list().get('operation')[-1].get('path'))"
     fi
 
+    # Everything the test ran in the container was analyzed on the fly by lib/log_analyzer.py
+    local log_digest="$current_test_tmp/log_digest.json"
+    [[ -e "$log_digest" ]] || echo '{"warnings": 0, "manually_modified": [], "errors": []}' > "$log_digest"
+    SET_RESULT "$(cat "$log_digest")" log_digest
+
+    # (Missing or altered witness files, cf check_witness_files)
+    local witness_report="$current_test_tmp/witness_report.json"
+    [[ ! -e "$witness_report" ]] || SET_RESULT "$(cat "$witness_report")" witness_report
+
     # Check that we don't have this message characteristic of a file that got manually modified,
     # which should not happen during tests because no human modified the file ...
-    if grep -q --extended-regexp 'has been manually modified since the installation or last upgrade. So it has been duplicated' "$current_test_log"; then
+    if jq -e '.manually_modified != []' "$log_digest" >/dev/null; then
         log_error "Apparently the log is telling that 'some file got manually modified' ... which should not happen, considering that no human modified the file ... ! This is usually symptomatic of something that modified a conf file after installing it with ynh_add_config. Maybe usigin ynh_store_file_checksum can help, or maybe the issue is more subtle!"
         if [[ "$test_type" == "TEST_UPGRADE" ]] && [[ "$test_arg" == "" ]]; then
             SET_RESULT "failure" file_manually_modified
@@ -140,7 +393,7 @@ TEST_LAUNCHER() {
     fi
 
     # Check that the number of warning ain't higher than a treshold
-    local n_warnings=$(grep -c --extended-regexp '^[0-9]+\s+.{1,15}WARNING' "$current_test_log")
+    local n_warnings=$(jq -r '.warnings' "$log_digest")
     # (we ignore this test for upgrade from older commits to avoid having to patch older commits for this)
     # shellcheck disable=SC2166
     if [ "$n_warnings" -gt 30 ] && [ "$test_type" != "TEST_UPGRADE" -o "$test_arg" == "" ]; then
@@ -156,6 +409,11 @@ TEST_LAUNCHER() {
     local test_duration=$(( $(date +%s) - global_start_timer))
     SET_RESULT "$test_duration" test_duration
 
+    if [[ -n "$cache_key" ]] && [ $test_result -eq 0 ]; then
+        cp "$current_test_results" "$results_cache_dir/$cache_key.json"
+        cp "$current_test_log" "$results_cache_dir/$cache_key.log"
+    fi
+
     break_before_continue
 
     # Restore the started time for the timer
@@ -170,9 +428,71 @@ TEST_LAUNCHER() {
     echo "$1 $2:$(date +%s):$$" >"$lock_file"
 }
 
+tests_in_order() {
+    # Cheap and high-signal tests first (cf lib/test_history.py)
+    python3 lib/test_history.py order "$TEST_CONTEXT" --app "$app_id"
+}
+
+level_tracker_start() {
+    # Keeps the results in memory during the whole run, cf min_level_is_unreachable
+    [ "$min_level" -gt 0 ] || return 0
+    coproc LEVEL_TRACKER { python3 lib/analyze_test_results.py "$TEST_CONTEXT" --follow; }
+}
+
+level_tracker_stop() {
+    [[ -z "${LEVEL_TRACKER_PID:-}" ]] || kill "$LEVEL_TRACKER_PID" 2>/dev/null
+}
+
+min_level_is_unreachable() {
+    # $1 = the test which just got done
+    local test_id=$1
+    [ "$min_level" -gt 0 ] || return 1
+
+    local max_reachable_level
+    echo "$test_id" >&"${LEVEL_TRACKER[1]}"
+    read -r max_reachable_level <&"${LEVEL_TRACKER[0]}" || return 1
+    if [ "$max_reachable_level" -lt "$min_level" ]; then
+        log_error "The app can't reach level $min_level anymore (level $max_reachable_level at best), the remaining tests are skipped"
+        return 0
+    fi
+    return 1
+}
+
+skip_remaining_tests() {
+    local test_id
+    for test_id in $(results_store query --main-result none --ids); do
+        results_store import "$test_id" <<< '{"main_result": "skipped", "test_duration": 0}'
+    done
+}
+
+results_cache_key() {
+    # The fingerprint of the test's inputs, computed by parse_tests_toml.py,
+    # plus the versions of package_check, including its uncommitted changes (and of the linter, for the linter test)
+    local testfile=$1
+    local fingerprint=$(jq -r '.fingerprint // empty' "$testfile")
+    [[ -n "$fingerprint" ]] || return 0
+
+    local versions="$(git rev-parse HEAD 2>/dev/null) $(git diff HEAD -- lib package_check.sh 2>/dev/null | sha256sum | cut -d' ' -f1)"
+    if [[ "$(jq -r '.test_type' "$testfile")" == "TEST_PACKAGE_LINTER" ]]; then
+        versions+=" $(git -C ./package_linter rev-parse HEAD 2>/dev/null)"
+    fi
+
+    echo "$fingerprint $versions" | sha256sum | cut -d' ' -f1
+}
+
+results_store() {
+    # cf lib/results_store.py, e.g. results_store query --test-type TEST_INSTALL --main-result success
+    local action=$1
+    python3 lib/results_store.py "$action" "$TEST_CONTEXT" "${@:2}"
+}
+
 SET_RESULT() {
     local result=$1
     local name=$2
+    if [ "$name" == "log_digest" ]; then
+        results_store set "$current_test_id" "$name" "$result" --json
+        return
+    fi
     if [ "$name" != "test_duration" ]; then
         if [ "$result" == "success" ]; then
             log_report_test_success
@@ -180,20 +500,14 @@ SET_RESULT() {
             log_report_test_failed
         fi
     fi
-    local current_results="$(cat "$current_test_results")"
-    echo "$current_results" | jq --arg result "$result" ".$name=\$result" > "$current_test_results"
+    results_store set "$current_test_id" "$name" "$result"
 }
 
 #=================================================
 
 at_least_one_install_succeeded() {
 
-    for TEST in "$TEST_CONTEXT"/tests/*.json; do
-        local test_id=$(basename "$TEST" | cut -d. -f1)
-        jq -e '. | select(.test_type == "TEST_INSTALL")' "$TEST" >/dev/null \
-            && jq -e '. | select(.main_result == "success")' "$TEST_CONTEXT/results/$test_id.json" >/dev/null \
-            && return 0
-    done
+    results_store query --test-type TEST_INSTALL --main-result success && return 0
 
     log_error "All installs failed, therefore the following tests cannot be performed..."
     return 1
@@ -223,15 +537,14 @@ start_test() {
 there_is_an_install_type() {
     local install_type=$1
 
-    for TEST in "$TEST_CONTEXT/tests"/*.json; do
-        if jq --arg install_type "$install_type" \
-            -e '. | select(.test_type == "TEST_INSTALL") | select(.test_arg == $install_type)' "$TEST" >/dev/null
-        then
-            return 0
-        fi
-    done
+    [[ "$install_types" == *" $install_type "* ]]
+}
 
-    return 1
+test_plan_applies_to() {
+    # The test plan is computed from the current version of the app, but
+    # upgrade tests temporarily checkout older commits in $package_path
+    local file=$1
+    [[ -e "$package_path/$file" ]] && [[ ! "$package_path/$file" -nt "$test_plan" ]]
 }
 
 there_is_a_root_install_test() {
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# This script is ran *inside* the LXC (hence it only relies on the standard
+# library), such that all the witnesses are created or checked in a single exec:
+#
+#   python3 - create '[{"type": "file", "path": "/etc/witnessfile"}, ...]' < witness.py
+#   python3 - check "$(cat witness.json)" < witness.py
+#
+# `create` prints the witness list back with what's needed to check them later
+# (e.g. the checksum of the files), which is what `check` expects as input.
+# `check` prints a report like {"missing": [...], "altered": [...], "errors": [...]}
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def mysql(*cmd):
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def create_file(witness):
+    with open(witness["path"], "a"):
+        pass
+    witness["sha256"] = sha256(witness["path"])
+
+
+def create_directory(witness):
+    os.makedirs(witness["path"], exist_ok=True)
+
+
+def create_db(witness):
+    mysql("mysqladmin", "--wait", "status")
+    if mysql("mysql", "-e", f"CREATE DATABASE {witness['path']}").returncode != 0:
+        raise Exception(f"Failed to create database {witness['path']}")
+
+
+def check_file(witness):
+    if not os.path.isfile(witness["path"]):
+        return "missing"
+    if "sha256" in witness and sha256(witness["path"]) != witness["sha256"]:
+        return "altered"
+
+
+def check_directory(witness):
+    if not os.path.isdir(witness["path"]):
+        return "missing"
+
+
+def check_db(witness):
+    if mysql("mysqlshow", witness["path"]).returncode != 0:
+        return "missing"
+
+
+CREATE = {"file": create_file, "directory": create_directory, "db": create_db}
+CHECK = {"file": check_file, "directory": check_directory, "db": check_db}
+
+
+def main():
+    action, witnesses = sys.argv[1], json.loads(sys.argv[2])
+    report = {"missing": [], "altered": [], "errors": []}
+
+    for witness in witnesses:
+        try:
+            if action == "create":
+                CREATE[witness["type"]](witness)
+            else:
+                status = CHECK[witness["type"]](witness)
+                if status:
+                    report[status].append(witness["path"])
+        except Exception as e:
+            report["errors"].append(f"{witness['path']}: {e}")
+
+    if action == "create":
+        report["witnesses"] = witnesses
+
+    print(json.dumps(report))
+
+
+main()
@@ -1,97 +1,104 @@
 #!/bin/bash
+# shellcheck disable=SC2155
 
-set_witness_files () {
-    # Create files to check if the remove script does not remove them accidentally
-    log_debug "Create witness files..."
+# The witnesses are created/checked by lib/witness.py *inside* the LXC,
+# all at once, to avoid one exec (and container round-trip) per witness
 
-    create_witness_file () {
-        case "$1" in
-            file)       local action=(touch) ;;
-            directory)  local action=(mkdir -p) ;;
-            *) exit 1 ;;
-        esac
-        RUN_INSIDE_LXC timeout --signal TERM 10 "${action[@]}" "$2"
-    }
+_witness_list () {
+    # One witness per line: "<type> <path>" with type being file, directory or db
 
     # Nginx conf
-    create_witness_file file "/etc/nginx/conf.d/$DOMAIN.d/witnessfile.conf"
-    create_witness_file file "/etc/nginx/conf.d/$SUBDOMAIN.d/witnessfile.conf"
+    echo "file /etc/nginx/conf.d/$DOMAIN.d/witnessfile.conf"
+    echo "file /etc/nginx/conf.d/$SUBDOMAIN.d/witnessfile.conf"
 
     # /etc
-    create_witness_file file "/etc/witnessfile"
+    echo "file /etc/witnessfile"
 
     # /opt directory
-    create_witness_file directory "/opt/witnessdir"
+    echo "directory /opt/witnessdir"
 
     # /var/www directory
-    create_witness_file directory "/var/www/witnessdir"
+    echo "directory /var/www/witnessdir"
 
     # /home/yunohost.app/
-    create_witness_file directory "/home/yunohost.app/witnessdir"
+    echo "directory /home/yunohost.app/witnessdir"
 
     # /var/log
-    create_witness_file file "/var/log/witnessfile"
+    echo "file /var/log/witnessfile"
 
     # Config fpm
-    #create_witness_file file "/etc/php/$DEFAULT_PHP_VERSION/fpm/pool.d/witnessfile.conf"
+    #echo "file /etc/php/$DEFAULT_PHP_VERSION/fpm/pool.d/witnessfile.conf"
 
     # Config logrotate
-    create_witness_file file "/etc/logrotate.d/witnessfile"
+    echo "file /etc/logrotate.d/witnessfile"
 
     # Config systemd
-    create_witness_file file "/etc/systemd/system/witnessfile.service"
+    echo "file /etc/systemd/system/witnessfile.service"
 
     # Database
-    #RUN_INSIDE_LXC mysqladmin --wait status > /dev/null 2>&1
-    #echo "CREATE DATABASE witnessdb" | RUN_INSIDE_LXC mysql --wait > /dev/null 2>&1
+    #echo "db witnessdb"
 }
 
-check_witness_files () {
-    # Check all the witness files, to verify if them still here
-
-    check_file_exist () {
-        if RUN_INSIDE_LXC test ! -e "$1"
-        then
-            log_error "The file $1 is missing ! Something gone wrong !"
-            SET_RESULT "failure" witness
-        fi
-    }
-
-    sleep 2
-
-    # Nginx conf
-    check_file_exist "/etc/nginx/conf.d/$DOMAIN.d/witnessfile.conf"
-    check_file_exist "/etc/nginx/conf.d/$SUBDOMAIN.d/witnessfile.conf"
-
-    # /etc
-    check_file_exist "/etc/witnessfile"
-
-    # /opt directory
-    check_file_exist "/opt/witnessdir"
+_RUN_WITNESS_MANAGER () {
+    RUN_INSIDE_LXC timeout --signal TERM 30 python3 - "$@" < ./lib/witness.py
+}
 
-    # /var/www directory
-    check_file_exist "/var/www/witnessdir"
+set_witness_files () {
+    # Create files to check if the remove script does not remove them accidentally
+    log_debug "Create witness files..."
 
-    # /home/yunohost.app/
-    check_file_exist "/home/yunohost.app/witnessdir"
+    local witnesses="$(_witness_list | jq --raw-input --null-input --compact-output '[inputs | capture("(?<type>\\S+) (?<path>.*)")]')"
+    local report="$(_RUN_WITNESS_MANAGER create "$witnesses")"
 
-    # /var/log
-    check_file_exist "/var/log/witnessfile"
+    if [[ -z "$report" ]]
+    then
+        log_error "Failed to create the witness files"
+        return 1
+    fi
 
-    # Config fpm
-    #check_file_exist "/etc/php/$DEFAULT_PHP_VERSION/fpm/pool.d/witnessfile.conf"
+    jq -r '.errors[]' <<< "$report" | while read -r error
+    do
+        log_warning "Failed to create witness $error"
+    done
 
-    # Config logrotate
-    check_file_exist "/etc/logrotate.d/witnessfile"
+    # Keep the witnesses along with their checksums for check_witness_files
+    jq --compact-output '.witnesses' <<< "$report" > "$TEST_CONTEXT/witness.json"
+}
 
-    # Config systemd
-    check_file_exist "/etc/systemd/system/witnessfile.service"
+check_witness_files () {
+    # Check all the witness files, to verify if them still here
 
-    # Database
-    #if ! RUN_INSIDE_LXC mysqlshow witnessdb > /dev/null 2>&1
-    #then
-    #    log_error "The database witnessdb is missing ! Something gone wrong !"
-    #    SET_RESULT "failure" witness
-    #    return 1
-    #fi
+    local report="$(_RUN_WITNESS_MANAGER check "$(cat "$TEST_CONTEXT/witness.json")")"
+
+    if [[ -z "$report" ]]
+    then
+        log_error "Failed to check the witness files ! Something gone wrong !"
+        SET_RESULT "failure" witness
+        return
+    fi
+
+    # shellcheck disable=SC2154
+    echo "$report" > "$current_test_tmp/witness_report.json"
+
+    local path
+    local failed=false
+    for path in $(jq -r '.missing[]' <<< "$report")
+    do
+        log_error "The file $path is missing ! Something gone wrong !"
+        failed=true
+    done
+    for path in $(jq -r '.altered[]' <<< "$report")
+    do
+        log_error "The file $path was unexpectedly modified ! Something gone wrong !"
+        failed=true
+    done
+    jq -r '.errors[]' <<< "$report" | while read -r error
+    do
+        log_warning "Failed to check witness $error"
+    done
+
+    if [[ "$failed" == true ]]
+    then
+        SET_RESULT "failure" witness
+    fi
 }
@@ -19,11 +19,18 @@ print_help() {
                                 images are supposed to be fetch from
                                 repo.yunohost.org/incus automatically)
     -S, --storage-dir DIRECTORY Where to store temporary test files like yunohost backups
+                                (the backup archives are written there directly by the containers)
+    -n, --no-cache              Run all the tests, even the ones which succeeded in a previous run with the same inputs
+    -B, --batch QUEUE_FILE      Test the apps listed in this file (one path or URL per line) one after the other
+                                (the results of each app end up in batch_results_<WORKER_ID>/)
+    -l, --min-level=LEVEL       Stop running tests as soon as the app can't reach this level anymore
     -h, --help                  Display this help
 
     Pass YNHDEV_BACKEND=incus|lxd to use a specific LXD-compatible backend.
     Pass DIST=bookworm|trixie to use a specific distribution version
     Pass YNH_BRANCH=stable|unstable to use a specific Yunohost branch
+    Pass PARALLEL_JOBS=N to run independent tests in parallel on N containers
+    Pass BATCH_POOL_SIZE=N to launch N containers in advance for the next apps in batch mode
 
 EOF
 exit 0
@@ -44,7 +51,10 @@ interactive=0
 interactive_on_errors=0
 rebuild=0
 force_stop=0
+use_results_cache=1
+min_level=0
 storage_dir="${YNH_PACKAGE_CHECK_STORAGE_DIR:-}"
+batch_queue=""
 
 function parse_args() {
 
@@ -58,12 +68,19 @@ function parse_args() {
             getopts_built_arg+=(-b)
             arguments[i]=${arguments[i]//--branch=/}
         fi
+        if [[ "${arguments[i]}" =~ "--min-level=" ]]
+        then
+            getopts_built_arg+=(-l)
+            arguments[i]=${arguments[i]//--min-level=/}
+        fi
         # For each argument in the array, reduce to short argument for getopts
         arguments[i]=${arguments[i]//--interactive/-i}
         arguments[i]=${arguments[i]//--dry-run/-D}
         arguments[i]=${arguments[i]//--rebuild/-r}
         arguments[i]=${arguments[i]//--force-stop/-s}
-        arguments[i]=${arguments[i]//--storage-dir/-s}
+        arguments[i]=${arguments[i]//--storage-dir/-S}
+        arguments[i]=${arguments[i]//--no-cache/-n}
+        arguments[i]=${arguments[i]//--batch/-B}
         arguments[i]=${arguments[i]//--help/-h}
         getopts_built_arg+=("${arguments[i]}")
     done
@@ -79,13 +96,18 @@ function parse_args() {
                 # Initialize the index of getopts
                 OPTIND=1
                 # Parse with getopts only if the argument begin by -
-                getopts ":b:Diresh" parameter || true
+                getopts ":b:l:S:B:Dirensh" parameter || true
                 case $parameter in
                     b)
                         # --branch=branch-name
                         gitbranch="$OPTARG"
                         shift_value=2
                         ;;
+                    l)
+                        # --min-level=level
+                        min_level="$OPTARG"
+                        shift_value=2
+                        ;;
                     i)
                         # --interactive
                         interactive=1
@@ -116,6 +138,16 @@ function parse_args() {
                         storage_dir=$OPTARG
                         shift_value=2
                         ;;
+                    n)
+                        # --no-cache
+                        use_results_cache=0
+                        shift_value=1
+                        ;;
+                    B)
+                        # --batch
+                        batch_queue=$OPTARG
+                        shift_value=2
+                        ;;
                     h)
                         # --help
                         print_help
@@ -153,7 +185,13 @@ parse_args
 function cleanup()
 {
     trap '' SIGINT # Disable ctrl+c in this function
+    # Kill the tests still running in parallel, if any
+    jobs -p | xargs -r kill 2>/dev/null
+    LXC_RESET_CLONES
     LXC_RESET
+    LXC_POOL_RESET
+
+    [ -n "${batch_dir:-}" ] && rm -rf "$batch_dir"
 
     [ -n "$TEST_CONTEXT" ] && rm -rf "$TEST_CONTEXT"
     [ -n "$lock_file" ] && rm -f "$lock_file"
@@ -219,6 +257,11 @@ fi
 self_upgrade
 fetch_or_upgrade_package_linter
 
+if [[ -n "$batch_queue" ]]; then
+    run_batch "$batch_queue"
+    exit 0
+fi
+
 if [[ -z "${TEST_CONTEXT:-}" ]]; then
     if [[ -n "$storage_dir" ]]; then
         TEST_CONTEXT=$(mktemp -d "$storage_dir/package_check.XXXXXX")